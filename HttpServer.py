@@ -1,61 +1,186 @@
 """ Sudoku HTTP Server"""
 from http.server import HTTPServer, BaseHTTPRequestHandler
+import itertools
 import json
+from urllib.parse import urlsplit, parse_qs
 import time
-from sudoku import Sudoku
+from sudoku import Sudoku, valid_grid
 
 
 class sudokuHTTP(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive and chunked responses
+    timeout = 60 # close keep-alive connections idle for this long
+
     def __init__(self, callback, *args, **kwargs):
         self.callback = callback
         super().__init__(*args, **kwargs)
 
 
     def do_POST(self):
-        if self.path == '/solve':
-            content_length = int(self.headers['Content-Length'])
+        path, query = self.route()
+        if path == '/solve':
+            content_length = int(self.headers.get('Content-Length', 0))
             post_data = self.rfile.read(content_length)
-            sudoku = json.loads(post_data)
+            try:
+                sudoku = json.loads(post_data)
+                sudoku['sudoku']
+            except (json.JSONDecodeError, TypeError, KeyError) as e:
+                self.send_json(400, {'error': f'Invalid sudoku: {e}'})
+                return
+            if not valid_grid(sudoku['sudoku']):
+                self.send_json(400, {'error': 'Invalid sudoku: expected 9 rows of 9 digits from 0 to 9'})
+                return
+            if 'async' in query:
+                sudoku['async'] = query['async'][0] not in ('0', 'false')
             # print(sudoku)
             # self.callback(sudoku) # chamar o callback
             # receive what comes from the callback
             solved_sudoku = self.callback(sudoku)
+
+            if sudoku.get('async'):
+                # o sudoku continua a ser resolvido, ver GET /jobs/<id>
+                self.send_json(202, solved_sudoku, {'Location': f"/jobs/{solved_sudoku['id']}"})
+                return
             # build a json response
             response = {'sudoku': solved_sudoku}
 
+            self.send_json(200, response)
+        elif path == '/solve/batch':
+            try:
+                puzzles = self.batch_puzzles()
+                first = next(puzzles, None)
+            except (ValueError, json.JSONDecodeError) as e:
+                # the rest of the body wasn't read
+                self.close_connection = True
+                self.send_json(400, {'error': f'Invalid batch: {e}'})
+                return
+
+            # resolver os sudokus e enviar cada solução assim que estiver pronta
             self.send_response(200)
-            self.send_header('Content-type', 'application/json')
+            self.send_header('Content-type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
             self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
+
+            if first is not None:
+                for result in self.callback(('batch', itertools.chain([first], puzzles))):
+                    self.write_chunk(json.dumps(result).encode() + b'\n')
+            self.write_chunk(b'')
         else:
-            self.send_response(404)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Page not found! Go to /solve istead'}).encode())
+            self.close_connection = True # the body wasn't read
+            self.send_json(404, {'error': 'Page not found! Go to /solve istead'})
 
     def do_GET(self):
-        if self.path == '/stats':
+        path, query = self.route()
+        if path == '/stats':
 
             # retornar os status da rede p2p
             status = self.callback('stats')
 
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(status).encode())
-        elif self.path == '/network':
+            self.send_json(200, status)
+        elif path == '/network':
             # retornar a lista de connexões
             network = self.callback('network')
 
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(network).encode())
+            self.send_json(200, network)
+        elif path.startswith('/jobs/'):
+            # estado do job, esperando até 'wait' segundos que termine
+            try:
+                timeout = float(query.get('wait', [0])[0])
+            except ValueError:
+                self.send_json(400, {'error': 'wait must be a number of seconds'})
+                return
+
+            job = self.callback(('job', path[len('/jobs/'):], timeout))
+            if job is None:
+                self.send_json(404, {'error': 'Job not found'})
+            else:
+                self.send_json(200, job)
         else:
-            self.send_response(404)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Page not found, check /stats or /network'}).encode())
+            self.send_json(404, {'error': 'Page not found, check /stats or /network'})
+
+    def do_DELETE(self):
+        path, _ = self.route()
+        if path.startswith('/jobs/'):
+            # cancelar o job em todos os nodes
+            job = self.callback(('cancel', path[len('/jobs/'):]))
+            if job is None:
+                self.send_json(404, {'error': 'Job not found'})
+            else:
+                self.send_json(200, job)
+        else:
+            self.send_json(404, {'error': 'Page not found, check /jobs/<id>'})
+
+    def route(self):
+        """Path and query parameters of the request"""
+        url = urlsplit(self.path)
+        return url.path, parse_qs(url.query)
+
+    def send_json(self, status, body, headers: dict = None):
+        """Send a json response"""
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def write_chunk(self, data: bytes):
+        """Write a chunk of a chunked response, an empty chunk ends the response"""
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+
+    def body_lines(self):
+        """Yields the lines of the request body as they arrive"""
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            buffer = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    # skip the trailers
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                buffer += self.rfile.read(size)
+                self.rfile.readline()
+                *lines, buffer = buffer.split(b'\n')
+                yield from lines
+            if buffer:
+                yield buffer
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining > 0:
+                line = self.rfile.readline(remaining)
+                if not line:
+                    break
+                remaining -= len(line)
+                yield line
+
+    def batch_puzzles(self):
+        """Yields the sudokus of a batch, sent as a json array or as ndjson"""
+        lines = (line for line in self.body_lines() if line.strip())
+        first = next(lines, None)
+        if first is None:
+            return
+
+        if first.lstrip().startswith(b'['):
+            items = json.loads(b''.join(itertools.chain([first], lines)))
+            # a single sudoku grid is not a batch
+            if items and isinstance(items[0], list) and items[0] and isinstance(items[0][0], int):
+                raise ValueError('expected a list of sudokus')
+            for item in items:
+                yield item if isinstance(item, dict) else {'sudoku': item}
+            return
+
+        for line in itertools.chain([first], lines):
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {'error': f'Invalid sudoku: {e}'}
+                continue
+            yield item if isinstance(item, dict) else {'sudoku': item}
 
 # server = HTTPServer(('localhost', 8080), sudokuHTTP)
 # print('Server running ...')
@@ -0,0 +1,192 @@
+'''Solved sudoku cache'''
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from itertools import chain
+
+from canonical import canonical, Transform
+
+KEY_SIZE = 16 # bytes of a board digest
+BOARD_SIZE = 81 # one byte per cell
+RECORD_SIZE = KEY_SIZE + BOARD_SIZE # entry in the cache file
+DIGITS = frozenset(range(1, 10))
+
+
+def grid_board(grid: list[list[int]]) -> bytes:
+    """The 81 cells of a grid, one byte each"""
+    return bytes(chain.from_iterable(grid or ()))
+
+
+def board_key(grid: list[list[int]]) -> bytes:
+    """Fixed size digest of a sudoku grid"""
+    return hashlib.blake2b(grid_board(grid), digest_size=KEY_SIZE).digest()
+
+
+def board_grid(board: bytes) -> list[list[int]]:
+    """Grid of a board made by grid_board"""
+    return [list(board[row * 9:row * 9 + 9]) for row in range(9)]
+
+
+def board_text(board: bytes) -> str:
+    """Board as a string of 81 digits, as sent to other nodes"""
+    return ''.join(map(str, board))
+
+
+def text_board(text: str) -> bytes:
+    """Board of a string made by board_text"""
+    return bytes(map(int, text))
+
+
+def valid_board(board: bytes) -> bool:
+    """The board is a complete grid"""
+    return len(board) == BOARD_SIZE and DIGITS.issuperset(board)
+
+
+class SolutionCache:
+    """Solutions of the sudokus solved by this node, the least recently used ones are forgotten
+
+    Sudokus are kept in their canonical form, so a sudoku that only differs
+    from a cached one by its symmetries is found too.
+
+    With a path every solution is also appended to that file, which is read
+    the first time the cache is used, so the cache survives restarts.
+    """
+
+    def __init__(self, max_entries: int = 100000, max_bytes: int = 16 * 1024 * 1024, path: str = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self.entries = OrderedDict() # key: solved board, the most recently used last
+        self.lock = threading.Lock()
+        self.loaded = path is None
+        self.file = None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, grid: list[list[int]]) -> tuple[bytes, Transform]:
+        """Key of a sudoku and the transformation to its canonical form"""
+        grid, transform = canonical(grid)
+        return board_key(grid), transform
+
+    def get(self, grid: list[list[int]]) -> list[list[int]] | None:
+        """The solution of a sudoku, None if it isn't cached"""
+        key, transform = self.key(grid)
+        board = self.get_board(key)
+        if board is None:
+            return None
+        return transform.invert(board_grid(board))
+
+    def put(self, grid: list[list[int]], solution: list[list[int]]) -> bool:
+        """Cache the solution of a sudoku
+        Returns:
+            bool: False if the solution isn't a complete grid
+        """
+        if not valid_board(grid_board(solution)):
+            return False
+        key, transform = self.key(grid)
+        return self.put_board(key, grid_board(transform.apply(solution)))
+
+    def get_board(self, key: bytes) -> bytes | None:
+        """The canonical solution kept with a key"""
+        with self.lock:
+            self.load()
+            board = self.entries.get(key)
+            if board is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return board
+
+    def put_board(self, key: bytes, board: bytes) -> bool:
+        """Keep the canonical solution of a key
+        Returns:
+            bool: False if the key or the board aren't valid
+        """
+        if len(key) != KEY_SIZE or not valid_board(board):
+            return False
+        with self.lock:
+            self.load()
+            known = key in self.entries
+            self.store(key, board)
+            if not known and self.path is not None:
+                self.append(key + board)
+        return True
+
+    def store(self, key: bytes, board: bytes):
+        """Add an entry, evicting the least recently used ones over the limits"""
+        self.entries[key] = board
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries or len(self.entries) * RECORD_SIZE > self.max_bytes:
+            self.entries.popitem(last=False)
+
+    def preload(self):
+        """Read the cache file before the first sudoku needs it"""
+        with self.lock:
+            self.load()
+
+    def load(self):
+        """Read the cache file, once"""
+        if self.loaded:
+            return
+        self.loaded = True
+        records = 0
+        partial = False
+        try:
+            with open(self.path, 'rb') as file:
+                while record := file.read(RECORD_SIZE):
+                    if len(record) < RECORD_SIZE:
+                        partial = True # cortado a meio de uma escrita
+                        break
+                    records += 1
+                    board = record[KEY_SIZE:]
+                    if valid_board(board):
+                        self.store(record[:KEY_SIZE], board)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Erro ao ler o cache {self.path}: {e}")
+            return
+
+        # reescrever o ficheiro se tiver muitas entradas esquecidas
+        if partial or records > 2 * len(self.entries):
+            self.compact()
+        print(f"Cache: {len(self.entries)} sudokus lidos de {self.path}")
+
+    def append(self, record: bytes):
+        """Append an entry to the cache file"""
+        try:
+            if self.file is None:
+                self.file = open(self.path, 'ab')
+            self.file.write(record)
+            self.file.flush()
+        except OSError as e:
+            print(f"Erro ao escrever no cache {self.path}: {e}")
+
+    def compact(self):
+        """Rewrite the cache file with the entries still cached"""
+        temp = f"{self.path}.tmp"
+        try:
+            with open(temp, 'wb') as file:
+                file.writelines(key + board for key, board in self.entries.items())
+            os.replace(temp, self.path)
+        except OSError as e:
+            print(f"Erro ao compactar o cache {self.path}: {e}")
+
+    def items(self) -> list[tuple[bytes, bytes]]:
+        """The cached keys and canonical solutions"""
+        with self.lock:
+            self.load()
+            return list(self.entries.items())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self) -> dict:
+        """Cache usage as shown in /stats"""
+        with self.lock:
+            return {"entries": len(self.entries),
+                    "bytes": len(self.entries) * RECORD_SIZE,
+                    "hits": self.hits,
+                    "misses": self.misses}
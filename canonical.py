@@ -0,0 +1,114 @@
+'''Canonical form of a sudoku under the transformations that keep it valid'''
+from itertools import permutations, product
+
+TRIPLES = list(permutations(range(3)))
+# orders of the rows (or columns) that keep a sudoku valid: the bands, then the rows of each band
+ORDERS = [tuple(3 * band + row for band, rows in zip(bands, within) for row in rows)
+          for bands in TRIPLES for within in product(TRIPLES, repeat=3)]
+MAX_TIES = 20000 # transformations compared before giving up on a very symmetric sudoku
+
+
+class Transform:
+    """Transposition, row and column orders and digit relabeling of a sudoku"""
+
+    def __init__(self, transpose: bool, rows, cols, digits):
+        self.transpose = transpose
+        self.rows = rows # row of the original grid placed at each row
+        self.cols = cols # column of the original grid placed at each column
+        self.digits = digits # new digit of each digit, 0 stays 0
+
+    def apply(self, grid: list[list[int]]) -> list[list[int]]:
+        """Transform a grid"""
+        source = list(zip(*grid)) if self.transpose else grid
+        digits = self.digits
+        return [[digits[source[r][c]] for c in self.cols] for r in self.rows]
+
+    def invert(self, grid: list[list[int]]) -> list[list[int]]:
+        """Undo the transformation of a grid"""
+        digits = [0] * 10
+        for digit, new in enumerate(self.digits):
+            digits[new] = digit
+        source = [[0] * 9 for _ in range(9)]
+        for row, r in zip(grid, self.rows):
+            for value, c in zip(row, self.cols):
+                source[r][c] = digits[value]
+        return [list(col) for col in zip(*source)] if self.transpose else source
+
+
+IDENTITY = Transform(False, range(9), range(9), list(range(10)))
+
+
+def canonical(grid: list[list[int]]) -> tuple[list[list[int]], Transform]:
+    """The representative of all the sudokus equivalent to 'grid'
+
+    Among the transpositions and row/column orders, keeps the ones that put
+    the clues first, then relabels the digits in order of appearance and
+    keeps the smallest grid. Equivalent sudokus have the same canonical grid.
+    Returns:
+        tuple: the canonical grid and the transformation that gives it
+    """
+    best, tied = None, []
+    for transpose in (False, True):
+        source = list(zip(*grid)) if transpose else grid
+        clues = [[c for c in range(9) if row[c]] for row in source]
+        for cols in ORDERS:
+            position = [0] * 9
+            for j, c in enumerate(cols):
+                position[c] = 1 << (8 - j)
+            masks = [sum(position[c] for c in row) for row in clues]
+            # as many clues as possible on the first rows
+            key = sorted((sorted(masks[band:band + 3], reverse=True) for band in (0, 3, 6)), reverse=True)
+            if best is None or key > best:
+                best, tied = key, []
+            if key == best:
+                tied.append((transpose, source, cols, masks))
+
+    pattern = [mask for band in best for mask in band]
+    canon, found = None, None
+    count = 0
+    for transpose, source, cols, masks in tied:
+        for rows in row_orders(masks, pattern):
+            count += 1
+            if count > MAX_TIES:
+                # demasiadas simetrias, usar o sudoku como está
+                return [list(row) for row in grid], IDENTITY
+            digits = [0] * 10
+            labels = 0
+            sequence = []
+            for r in rows:
+                row = source[r]
+                for c in cols:
+                    value = row[c]
+                    if value:
+                        if not digits[value]:
+                            labels += 1
+                            digits[value] = labels
+                        sequence.append(digits[value])
+            if canon is None or sequence < canon:
+                canon, found = sequence, (transpose, rows, cols, digits)
+
+    transpose, rows, cols, digits = found
+    # digits that aren't in the sudoku get the remaining labels
+    labels = max(digits)
+    for value in range(1, 10):
+        if not digits[value]:
+            labels += 1
+            digits[value] = labels
+    transform = Transform(transpose, rows, cols, digits)
+    return transform.apply(grid), transform
+
+
+def row_orders(masks: list[int], pattern: list[int], order: tuple = ()):
+    """Yields the row orders that give the rows of 'pattern'"""
+    if len(order) == 9:
+        yield order
+        return
+    if len(order) % 3:
+        band = order[-1] - order[-1] % 3
+        rows = [r for r in range(band, band + 3) if r not in order]
+    else:
+        bands = {r - r % 3 for r in order}
+        rows = [r for r in range(9) if r - r % 3 not in bands]
+    for r in rows:
+        if masks[r] == pattern[len(order)]:
+            yield from row_orders(masks, pattern, order + (r,))
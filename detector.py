@@ -0,0 +1,58 @@
+'''Phi accrual failure detector'''
+import math
+from collections import deque
+
+
+class PhiAccrualDetector:
+    """Suspicion level of a node, from the intervals between the messages it sent
+
+    phi is -log10 of the probability that a live node is this late, with
+    the intervals taken as normally distributed: phi 1 is a 10% chance,
+    phi 3 a 0.1% chance.
+    """
+
+    def __init__(self, now: float, expected: float = 1.0, window: int = 100, min_std: float = 0.25, pause: float = 1.0):
+        self.intervals = deque([expected], maxlen=window) # seconds between sampled arrivals
+        self.rtts = deque(maxlen=window) # seconds of the last round trips
+        self.min_interval = expected / 2 # closer arrivals aren't sampled, traffic bursts would hide the heartbeats
+        self.min_std = min_std
+        self.pause = pause # silence accepted on top of the expected interval
+        self.sampled = now # last arrival added to the intervals
+        self.last = now # last arrival
+        # a single interval has no deviation, start with a quarter of the mean
+        self.seed = expected / 4
+
+    def heartbeat(self, now: float):
+        """A message from the node arrived"""
+        self.last = now
+        if now - self.sampled >= self.min_interval:
+            self.intervals.append(now - self.sampled)
+            self.sampled = now
+
+    def rtt(self, seconds: float):
+        """A keep_alive to the node was answered after 'seconds'"""
+        self.rtts.append(seconds)
+
+    def phi(self, now: float) -> float:
+        """Suspicion that the node failed"""
+        count = len(self.intervals)
+        mean = sum(self.intervals) / count
+        if count > 1:
+            std = math.sqrt(sum((interval - mean) ** 2 for interval in self.intervals) / count)
+        else:
+            std = self.seed
+        std = max(std, self.min_std)
+
+        # aproximação logística da distribuição normal
+        y = min(max((now - self.last - mean - self.pause) / std, -15.0), 15.0)
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if y > 0:
+            return -math.log10(e / (1.0 + e))
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
+
+    def describe(self, now: float) -> dict:
+        """Suspicion and round trip time as shown in /network"""
+        rtt = sum(self.rtts) / len(self.rtts) if self.rtts else None
+        return {"phi": round(self.phi(now), 2),
+                "rtt_ms": round(rtt * 1000, 2) if rtt is not None else None,
+                "silence": round(now - self.last, 2)}
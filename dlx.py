@@ -0,0 +1,136 @@
+"""Exact cover solver (Knuth's Algorithm X with Dancing Links)"""
+
+
+class DancingLinks:
+    """Sparse exact cover matrix kept as circular doubly linked lists.
+
+    Node 0 is the root, nodes 1..columns are the column headers and the
+    remaining nodes are the 1s of the matrix.
+    """
+
+    def __init__(self, columns: int, rows: list[list[int]]):
+        n = columns + 1
+        self.L = [i - 1 for i in range(n)]
+        self.R = [i + 1 for i in range(n)]
+        self.L[0], self.R[columns] = columns, 0
+        self.U = list(range(n))
+        self.D = list(range(n))
+        self.C = list(range(n))
+        self.S = [0] * n
+        self.row_of = [-1] * n
+
+        for row_id, cols in enumerate(rows):
+            first = None
+            for col in cols:
+                c = col + 1
+                node = len(self.C)
+                self.C.append(c)
+                self.row_of.append(row_id)
+                # insert at the bottom of the column
+                self.U.append(self.U[c])
+                self.D.append(c)
+                self.D[self.U[c]] = node
+                self.U[c] = node
+                self.S[c] += 1
+                # insert at the end of the row
+                if first is None:
+                    first = node
+                    self.L.append(node)
+                    self.R.append(node)
+                else:
+                    self.L.append(self.L[first])
+                    self.R.append(first)
+                    self.R[self.L[first]] = node
+                    self.L[first] = node
+
+        self.solution = []
+
+    def _cover(self, c):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        R[L[c]], L[R[c]] = R[c], L[c]
+        i = D[c]
+        while i != c:
+            j = R[i]
+            while j != i:
+                D[U[j]], U[D[j]] = D[j], U[j]
+                S[C[j]] -= 1
+                j = R[j]
+            i = D[i]
+
+    def _uncover(self, c):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        i = U[c]
+        while i != c:
+            j = L[i]
+            while j != i:
+                S[C[j]] += 1
+                D[U[j]] = j
+                U[D[j]] = j
+                j = L[j]
+            i = U[i]
+        R[L[c]] = c
+        L[R[c]] = c
+
+    def search(self, on_choice=None) -> list[int] | None:
+        """Returns the rows of an exact cover, or None if there is none.
+
+        'on_choice' is called every time a row is tried.
+        """
+        L, R, D, C, S = self.L, self.R, self.D, self.C, self.S
+        if R[0] == 0:
+            return list(self.solution)
+
+        # choose the column with fewest 1s
+        c, size = R[0], S[R[0]]
+        j = R[c]
+        while j != 0:
+            if S[j] < size:
+                c, size = j, S[j]
+            j = R[j]
+        if size == 0:
+            return None
+
+        self._cover(c)
+        r = D[c]
+        while r != c:
+            if on_choice is not None:
+                on_choice()
+            self.solution.append(self.row_of[r])
+            j = R[r]
+            while j != r:
+                self._cover(C[j])
+                j = R[j]
+
+            found = self.search(on_choice)
+
+            j = L[r]
+            while j != r:
+                self._uncover(C[j])
+                j = L[j]
+            self.solution.pop()
+            if found is not None:
+                self._uncover(c)
+                return found
+            r = D[r]
+
+        self._uncover(c)
+        return None
+
+
+def sudoku_matrix(grid: list[list[int]]) -> tuple[list[tuple[int, int, int]], list[list[int]]]:
+    """Encodes a Sudoku grid as a 324 column exact cover problem.
+
+    Columns are cell, row/digit, column/digit and box/digit constraints.
+    Returns the (row, col, num) of every matrix row and the matrix rows.
+    """
+    choices = []
+    rows = []
+    for r in range(9):
+        for c in range(9):
+            b = 3 * (r // 3) + c // 3
+            nums = [grid[r][c]] if grid[r][c] else range(1, 10)
+            for num in nums:
+                d = num - 1
+                choices.append((r, c, num))
+                rows.append([r * 9 + c, 81 + r * 9 + d, 162 + c * 9 + d, 243 + b * 9 + d])
+    return choices, rows
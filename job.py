@@ -0,0 +1,290 @@
+'''Sudoku solve jobs'''
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from sudoku import assignments
+
+MAX_NOGOODS = 256 # nogoods kept for a job, the oldest are forgotten
+MAX_ATTEMPTS = 3 # times a task is given to other nodes before only this node's workers take it
+TASK_DEADLINE = 30 # least seconds another node has to finish a task before it is queued again
+DEADLINE_FACTOR = 4 # times the usual time of a task of the job another node has to finish it
+MAX_SPECULATIVE = 8 # copies of running tasks a job can give to idle nodes
+SPECULATE_AFTER = 1.0 # least seconds a task runs before a copy of it is given to an idle node
+SPECULATE_FACTOR = 2 # ... or this many times the usual time of a task of the job, if longer
+
+
+class SolveJob:
+    """A sudoku being solved by this node and its peers"""
+
+    def __init__(self, sudoku_id: str, puzzle: list[list[int]], solver: str, cancel):
+        self.id = sudoku_id
+        self.puzzle = puzzle # sudoku as it was received
+        self.grid = puzzle # sudoku the tasks were split from
+        self.solver = solver
+        self.cancel = cancel # event set to stop the local solvers
+        self.queue = queue.Queue() # (task id, task) waiting for a node
+        self.local = queue.Queue() # (task id, task) that failed MAX_ATTEMPTS times on other nodes
+        self.task_list = {} # peer: {task id: task}
+        self.ledger = {} # task id: (owner, time it was assigned)
+        self.attempts = {} # task id: times it was given to other nodes
+        self.late = {} # task id: node that passed the deadline of the task, and may still be solving it
+        self.durations = deque(maxlen=100) # seconds the last finished tasks took
+        self.copies = {} # task id: node given a copy of the task, the ledger has the other owner
+        self.speculated = 0 # copies given, at most MAX_SPECULATIVE
+        self.helpers = set() # nodes and workers that were given tasks
+        self.next_task_id = 0
+        self.pending_steals = set() # nodes asked for work that haven't replied yet
+        self.future = Future() # solved grid, or None if there is no solution
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.finished = False
+        self.cancelled = False
+        self.tasks = 0 # tasks created, split ones included
+        self.tried = 0 # tasks that were finished
+        self.end_time = None
+        self.canonical = None # cache key of the puzzle and the Transform to its canonical form
+        self.nogoods = [] # literal sets, beyond the grid, of the tasks that had no solution
+        self.pruned = 0 # queued tasks skipped because of a nogood
+        self.emptied = False # take() skipped the last tasks, so the job has no solution
+        self.hops = 0 # times the tasks of the job were delegated, sent with them
+        self.parent = None # (connection, sudoku id, task id, nogood) of the task this job was delegated for
+
+    def add_tasks(self, tasks, owner=None) -> bool:
+        """Queue tasks, the ones given away by 'owner' if it was asked for work
+        Returns:
+            bool: True if there is no work left
+        """
+        with self.lock:
+            for task in tasks:
+                self.queue.put((self.next_task_id, task))
+                self.next_task_id += 1
+            self.tasks += len(tasks)
+            self.pending_steals.discard(owner)
+            return self.exhausted()
+
+    def take(self, owner, count: int = 1) -> list[tuple[int, list]]:
+        """Assign up to 'count' tasks to 'owner'
+        Returns:
+            list: the task ids and tasks, empty if there are none
+        """
+        taken, skipped, pruned = [], [], False
+        # os workers locais (owner str) também resolvem as tarefas que falharam noutros nodes
+        local = isinstance(owner, str)
+        queues = (self.local, self.queue) if local else (self.queue,)
+        with self.lock:
+            if self.finished:
+                return taken
+            while len(taken) < count:
+                item = next((q.get_nowait() for q in queues if not q.empty()), None)
+                if item is None:
+                    break
+                task_id, task = item
+                if self.late.get(task_id) == owner:
+                    # o node atrasado ainda a está a resolver
+                    skipped.append(item)
+                    continue
+                if self.dead(task):
+                    # já se sabe que não tem solução
+                    self.tried += 1
+                    self.pruned += 1
+                    self.attempts.pop(task_id, None)
+                    self.late.pop(task_id, None)
+                    pruned = True
+                    continue
+                self.task_list.setdefault(owner, {})[task_id] = task
+                self.ledger[task_id] = (owner, time.time())
+                if not local:
+                    self.attempts[task_id] = self.attempts.get(task_id, 0) + 1
+                self.helpers.add(owner)
+                taken.append((task_id, task))
+            for task_id, task in skipped:
+                self.queue.put((task_id, task))
+            if pruned and self.exhausted():
+                # as tarefas saltadas eram as últimas
+                self.emptied = True
+        return taken
+
+    def release(self, owner, task_id: int = None) -> bool:
+        """Remove a task assigned to 'owner', any of them if 'task_id' is None
+        Returns:
+            bool: True if there is no work left
+        """
+        with self.lock:
+            tasks = self.task_list.get(owner)
+            if tasks:
+                if task_id is None:
+                    task_id = next(iter(tasks))
+                if tasks.pop(task_id, None) is not None:
+                    self.tried += 1
+                    self.attempts.pop(task_id, None)
+                    self.late.pop(task_id, None)
+                    entry = self.ledger.pop(task_id, None)
+                    if entry is not None:
+                        self.durations.append(time.time() - entry[1])
+                if not tasks:
+                    del self.task_list[owner]
+            return self.exhausted()
+
+    def requeue(self, owner, task_ids=None) -> int:
+        """Queue again the tasks assigned to 'owner', all of them if 'task_ids' is None
+
+        The node failed if 'task_ids' is None, otherwise it passed the deadline
+        of those tasks and won't be given them again.
+        Returns:
+            int: number of tasks queued again
+        """
+        with self.lock:
+            self.pending_steals.discard(owner)
+            tasks = self.task_list.get(owner)
+            if not tasks:
+                return 0
+            count = 0
+            for task_id in list(tasks if task_ids is None else task_ids):
+                task = tasks.pop(task_id, None)
+                if task is None:
+                    continue
+                copy = self.copies.pop(task_id, None)
+                if copy is not None:
+                    # o outro node continua com a tarefa
+                    if copy == owner:
+                        continue
+                    self.ledger[task_id] = (copy, time.time())
+                    continue
+                self.ledger.pop(task_id, None)
+                if task_ids is not None:
+                    self.late[task_id] = owner
+                # depois de MAX_ATTEMPTS só os workers deste node a resolvem
+                target = self.local if self.attempts.get(task_id, 0) >= MAX_ATTEMPTS else self.queue
+                target.put((task_id, task))
+                count += 1
+            if not tasks:
+                del self.task_list[owner]
+            return count
+
+    def speculate(self, owner, count: int = 1) -> list[tuple[int, list]]:
+        """Give 'owner' copies of up to 'count' of the oldest running tasks, when none is queued
+        Returns:
+            list: the task ids and tasks, empty if there are none
+        """
+        taken = []
+        with self.lock:
+            if self.finished or not self.queue.empty() or not self.local.empty():
+                return taken
+            usual = sum(self.durations) / len(self.durations) if self.durations else 0
+            oldest = time.time() - max(SPECULATE_AFTER, SPECULATE_FACTOR * usual)
+            running = sorted((sent, task_id, original) for task_id, (original, sent) in self.ledger.items()
+                             if original != owner and task_id not in self.copies and sent < oldest)
+            for _, task_id, original in running:
+                if len(taken) >= count or self.speculated >= MAX_SPECULATIVE:
+                    break
+                task = self.task_list[original][task_id]
+                if self.dead(task):
+                    continue
+                self.task_list.setdefault(owner, {})[task_id] = task
+                self.copies[task_id] = owner
+                self.speculated += 1
+                self.helpers.add(owner)
+                taken.append((task_id, task))
+        return taken
+
+    def drop_rival(self, owner, task_id: int):
+        """'owner' finished a task first, forget the other copy of it
+        Returns:
+            the owner of the other copy, to stop it, None if the task had no copy
+        """
+        with self.lock:
+            copy = self.copies.pop(task_id, None)
+            if copy is None:
+                return None
+            rival = self.ledger.get(task_id, (None,))[0] if owner == copy else copy
+            tasks = self.task_list.get(rival, {})
+            tasks.pop(task_id, None)
+            if not tasks:
+                self.task_list.pop(rival, None)
+            return rival
+
+    def expired(self) -> list[tuple[object, int]]:
+        """Tasks that other nodes didn't finish in time, as (owner, task id)
+
+        The deadline is TASK_DEADLINE, or longer if the finished tasks of
+        the job took long.
+        """
+        with self.lock:
+            usual = sum(self.durations) / len(self.durations) if self.durations else 0
+            deadline = time.time() - max(TASK_DEADLINE, DEADLINE_FACTOR * usual)
+            return [(owner, task_id) for task_id, (owner, sent) in self.ledger.items()
+                    if not isinstance(owner, str) and sent < deadline]
+
+    def add_nogood(self, literals) -> bool:
+        """Remember that a task with these literals (see sudoku.assignments) has no solution
+        Returns:
+            bool: False if a known nogood already covered it
+        """
+        nogood = frozenset(literals) - frozenset(assignments(self.grid))
+        with self.lock:
+            if any(known <= nogood for known in self.nogoods):
+                return False
+            self.nogoods = [known for known in self.nogoods if not nogood <= known]
+            self.nogoods.append(nogood)
+            del self.nogoods[:-MAX_NOGOODS]
+        return True
+
+    def dead(self, task) -> bool:
+        """The task has every literal of a nogood"""
+        if not self.nogoods:
+            return False
+        literals = frozenset(assignments(task[1]))
+        return any(nogood <= literals for nogood in self.nogoods)
+
+    def nogood_lists(self) -> list[list[int]]:
+        """The nogoods as sent to the solvers"""
+        with self.lock:
+            return [sorted(nogood) for nogood in self.nogoods]
+
+    def assigned(self, owner) -> int:
+        """Number of tasks 'owner' hasn't finished yet"""
+        return len(self.task_list.get(owner, ()))
+
+    def exhausted(self) -> bool:
+        """Every task was tried and none had a solution"""
+        return self.queue.empty() and self.local.empty() and not self.task_list and not self.pending_steals
+
+    def finish(self, grid, cancelled: bool = False) -> bool:
+        """Set the result of the job
+        Returns:
+            bool: False if the job had already finished
+        """
+        with self.lock:
+            if self.finished:
+                return False
+            self.finished = True
+            self.cancelled = cancelled
+            self.end_time = time.time()
+        self.future.set_result(grid)
+        return True
+
+    @property
+    def status(self) -> str:
+        if not self.finished:
+            return "running"
+        if self.cancelled:
+            return "cancelled"
+        return "solved" if self.future.result() is not None else "unsolvable"
+
+    def describe(self) -> dict:
+        """Status of the job as returned by the http api"""
+        with self.lock:
+            progress = {"tasks": self.tasks,
+                        "tried": self.tried,
+                        "queued": self.queue.qsize() + self.local.qsize(),
+                        "running": sum(map(len, self.task_list.values())),
+                        "pruned": self.pruned,
+                        "speculated": self.speculated,
+                        "elapsed": round((self.end_time or time.time()) - self.start_time, 3)}
+        job = {"id": self.id, "status": self.status, "progress": progress}
+        if self.finished:
+            job["sudoku"] = self.future.result()
+        return job
@@ -0,0 +1,86 @@
+'''Cluster membership spread by gossip'''
+import threading
+
+MEMBER_TIMEOUT = 20 # seconds the heartbeat count of a node may stay the same before it is taken as failed
+
+
+class MemberTable:
+    """Every node of the cluster, as known from gossip
+
+    Each node counts its own heartbeats and sends its table to a neighbor,
+    which keeps the highest count of each node. A node whose count stops
+    growing for 'timeout' seconds failed or left, and its last count is kept
+    for as long again so the older tables of other nodes don't bring it back.
+    """
+
+    def __init__(self, address: str, timeout: float = MEMBER_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self.heartbeat = 0
+        self.status = [0, 0] # solved and validations of this node
+        self.members = {} # address: [heartbeat, solved, validations, when the heartbeat last grew]
+        self.removed = {} # address: (last heartbeat, when the node was removed)
+        self.lock = threading.Lock()
+
+    def beat(self, solved: int, validations: int):
+        """Count a heartbeat of this node, with its stats"""
+        with self.lock:
+            self.heartbeat += 1
+            self.status = [solved, validations]
+
+    def digest(self) -> dict:
+        """The table to gossip, address: [heartbeat, solved, validations], this node included"""
+        with self.lock:
+            digest = {address: entry[:3] for address, entry in self.members.items()}
+            digest[self.address] = [self.heartbeat, *self.status]
+        return digest
+
+    def merge(self, digest: dict, now: float) -> bool:
+        """Keep the newest entries of a table gossiped by another node
+        Returns:
+            bool: True if a node joined
+        """
+        joined = False
+        with self.lock:
+            for address, (heartbeat, solved, validations) in digest.items():
+                if address == self.address:
+                    continue
+                removed = self.removed.get(address)
+                if removed is not None:
+                    if heartbeat <= removed[0]:
+                        continue
+                    # voltou com um heartbeat novo
+                    del self.removed[address]
+
+                entry = self.members.get(address)
+                if entry is None:
+                    self.members[address] = [heartbeat, solved, validations, now]
+                    joined = True
+                elif heartbeat > entry[0]:
+                    self.members[address] = [heartbeat, solved, validations, now]
+        return joined
+
+    def expire(self, now: float) -> bool:
+        """Remove the nodes whose heartbeat didn't grow for 'timeout' seconds
+        Returns:
+            bool: True if a node was removed
+        """
+        with self.lock:
+            failed = [address for address, entry in self.members.items() if now - entry[3] > self.timeout]
+            for address in failed:
+                self.removed[address] = (self.members.pop(address)[0], now)
+            for address, (_, when) in list(self.removed.items()):
+                if now - when > self.timeout:
+                    del self.removed[address]
+        return bool(failed)
+
+    def live(self) -> set[str]:
+        """Addresses of the nodes taken as alive, this node included"""
+        with self.lock:
+            return set(self.members) | {self.address}
+
+    def stats(self) -> dict:
+        """Solved sudokus and validations of each live node but this one"""
+        with self.lock:
+            return {address: {"solved": entry[1], "validations": entry[2]}
+                    for address, entry in self.members.items()}
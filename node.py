@@ -5,27 +5,62 @@ import socket
 import sys, platform, signal, os
 import time
 import threading
+import random
 import queue
-from collections import deque
+from collections import deque, OrderedDict
 import logging
 import traceback
 import uuid
-from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-from http.server import HTTPServer
+from http.server import ThreadingHTTPServer
 from HttpServer import sudokuHTTP
 
-from sudoku import Sudoku
+from sudoku import Sudoku, SOLVERS, assignments, solve_board, encode_board, decode_board, valid_grid
+from protocol import CDProto, CDProtoBadFormat, FrameReader, Message
+from job import SolveJob
+from cache import SolutionCache, board_grid, board_text, grid_board, text_board
+from ring import HashRing
+from timers import TimerWheel
+from detector import PhiAccrualDetector
+from members import MemberTable
+from throughput import PeerSpeed
 
-import json, pickle
 
 # logging config 
 logging.basicConfig(filename=f"{sys.argv[0]}.log", level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
+BUFFER_SIZE = 65536 # bytes read from a connection at a time
+SEND_BATCH = 65536 # queued bytes coalesced into one send
+TASKS_PER_WORKER = 4 # subproblems per worker when a sudoku is split
+STEAL_INTERVAL = 0.5 # seconds an idle self_solve waits before asking for work again
+MAX_CREDIT = 255 # most tasks assigned to a node at a time
+BATCH_WINDOW = 8 # sudokus of a batch solved at the same time
+NETWORK_TIMEOUT = 2 # seconds /network waits for the peers to reply
+JOB_HISTORY = 1000 # finished jobs kept for GET /jobs/<id>
+JOB_WAIT_LIMIT = 60 # longest wait of GET /jobs/<id>?wait=
+CACHE_REPLICAS = 2 # nodes that keep each solution of the cluster cache
+CACHE_TIMEOUT = 0.25 # seconds a solve waits for the cluster cache
+CACHE_STORE_BATCH = 500 # solutions in a cache_store message
+ACTIVE_VIEW = 5 # nodes this node stays connected to
+PASSIVE_VIEW = 30 # known nodes that replace the active ones that leave
+ACTIVE_WALK = 6 # hops of a forward_join before a node connects to the new node
+PASSIVE_WALK = 3 # hop of a forward_join where the new node joins the passive view
+SHUFFLE_INTERVAL = 10 # seconds between passive view exchanges
+SHUFFLE_SIZE = 8 # nodes sent in a join_reply or shuffle
+HEARTBEAT_INTERVAL = 1.0 # seconds without sending anything to a node before sending it a keep_alive
+STATS_INTERVAL = 3.0 # seconds between the keep_alive that carry this node's stats
+SUSPECT_PHI = 3 # suspicion shown in /network
+FAIL_PHI = 8 # suspicion at which the connection is closed
+TASK_CHECK_INTERVAL = 1.0 # seconds between the checks of the tasks past their deadline
+GOSSIP_INTERVAL = 1.0 # seconds between two exchanges of the membership table with a random neighbor
+MAX_HOPS = 3 # times a task can be delegated to the neighbors of the node that got it
+
 class Server:
     """Chat Server process."""
 
-    def __init__(self, host="", port=5000, httpport=8000, connect_port: tuple = None, handicap: int = 1):        
+    def __init__(self, host="", port=5000, httpport=8000, connect_port: tuple = None, handicap: int = 1, solver: str = "bitmask", processes: int = 0, prefetch: int = 2, cache: SolutionCache = None):        
         """Initialize server with host and port."""
         self.sel = selectors.DefaultSelector()
         
@@ -33,6 +68,7 @@ class Server:
         self._port = port
         self._http_port = httpport
         self._handicap = handicap * 0.001 # 0.001
+        self._solver = solver # solver engine, see sudoku.SOLVERS
         self.connect_to = connect_port
         self.myip = self.get_my_ip()
 
@@ -46,12 +82,27 @@ class Server:
 
         self.sel.register(self.sock, selectors.EVENT_READ, self.accept)
 
-        # http server
-        self.http_server = HTTPServer(('localhost', httpport), lambda *args, **kwargs: sudokuHTTP(self.sudoku_received, *args, **kwargs))
+        # socket pair to wake up the selector loop when another thread queues a message
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.sel.register(self.wakeup_recv, selectors.EVENT_READ, self.wakeup)
+
+        # http server, one thread per request so /stats answers during a solve
+        self.http_server = ThreadingHTTPServer(('localhost', httpport), lambda *args, **kwargs: sudokuHTTP(self.sudoku_received, *args, **kwargs))
 
         # connection data
-        self.connection: set = set()
+        self.connection: set = set() # active view, at most ACTIVE_VIEW nodes
+        self.unjoined: set = set() # accepted connections that haven't sent a join, such as the ones of direct()
         self.bind_connections: dict = {}
+        self.passive: set = set() # bind points of known nodes this node isn't connected to
+        self.membership_lock = threading.Lock()
+        self.readers: dict = {} # connection: FrameReader with its partial messages
+        self.encodings: dict = {} # connection: encoding agreed with the node
+        self.outbox: dict = {} # connection: deque of messages waiting to be sent
+        self.dirty: set = set() # connections with messages the selector loop hasn't tried to send
+        self.outbox_lock = threading.Lock()
+        self.loop_thread = None # sends from other threads wake up the selector loop
 
         self.network = {f"{self.myip}:{self._port}": []}
         self.stats = {  "solved": 0, 
@@ -59,295 +110,135 @@ class Server:
                       
 
         # vars for messages and sudoku
-        self.mySodokuGrid = Sudoku([])
-        self.mySodokuQueue = queue.Queue()
-        self.solution_found: bool = True
+        self.jobs = {} # sudokuId: SolveJob coordinated by this node
+        self.job_history = OrderedDict() # sudokuId: SolveJob, running and recently finished
+        self.job_lock = threading.Lock()
         self.checked: int = 0
+        self.busy: float = 0.0 # seconds the solvers of this node ran, summed over the workers
+        self.limiter = {"overhead": 0.0, "delay": 0.0} # time spent by the call limiter
         self.solved: int = 0 # how many sudokus were solved
         self.network_cache = {}
-        self.keep_alive_nodes = {}
-        self.task_list = {} # peer: task
-        self.sudoku_cache = {} # cache for the sudoku
-
-
-        # threading solved event
-        self.solved_event = threading.Event()
+        self.detectors = {} # connection: PhiAccrualDetector of the node
+        self.last_sent = {} # connection: when the last message was queued to the node
+        self.pings = {} # connection: when the last keep_alive was sent
+        self.timers = TimerWheel() # run by the selector loop
+        self.sudoku_cache = cache if cache is not None else SolutionCache() # solutions of the solved sudokus
+        self.address = f"{self.myip}:{self._port}"
+        self.members = MemberTable(self.address) # every node of the cluster, known by gossip
+        self.ring = HashRing([self.address]) # nodes that keep each solution of the cluster cache
+        self.ring_lock = threading.Lock()
+        self.cache_lookups = {} # key: futures waiting for a cache_lookup_reply
+        self.cache_lock = threading.Lock()
+        self.remote_hits = 0 # sudokus found in the cache of other nodes
+        self.running = {} # sudokuId: sudokus being solved on this node
+        self.cancel_tokens = {} # sudokuId: event set to stop its solvers
+        self.task_tokens = {} # (sudokuId, task id): event set to stop the solver of that task
+        self.stopped_tasks = set() # (sudokuId, task id) stopped before their solver started
+        self.task_lock = threading.Lock()
+        self.idle_nodes = set() # nodes waiting for work
+        self.speeds = PeerSpeed() # throughput of this node and its neighbors
+        self.last_result = {} # connection: when the node last sent the result of a task
+        self.delegated = {} # sudokuId: jobs this node coordinates for tasks of that sudoku
+
+
+        # threading events
+        self.work_ready = threading.Condition() # wakes the local workers when tasks are queued
         self.network_event = threading.Event()
         self.network_count = 0
         self.sudokuIds = {str: bool}
-        self.current_sudoku_id = None
-        self.pool = ThreadPoolExecutor(20)
+
+        # solve in worker processes, one self_solve per worker
+        self.process_pool = None
+        self.local_workers = 1
+        if processes:
+            # spawn so the workers don't inherit this node's sockets
+            context = multiprocessing.get_context("spawn")
+            self.manager = context.Manager()
+            self.process_pool = ProcessPoolExecutor(processes, mp_context=context)
+            self.local_workers = processes
+        self.pool = ThreadPoolExecutor(20 + 2 * self.local_workers)
+
+        # tasks sent by other nodes, solved in order by local_workers threads
+        self.inbox = queue.Queue()
+        self.credit = self.local_workers + prefetch # tasks this node wants from each coordinator
+        self.windows = {} # connection: tasks the node wants to have assigned
+        self.peers = {} # connection: address of its other end, still known after the connection fails
 
     def accept(self, sock, mask):
         """Accept incoming connections."""
         print("Server is accepting a new connection.")
         conn, addr = sock.accept()  # Should be ready
         conn.setblocking(False)
+        self.peers[conn] = addr
         self.sel.register(conn, selectors.EVENT_READ, self.read)
-        self.connection.add(conn)
+        # só entra na vista ativa quando enviar o join
+        self.unjoined.add(conn)
         
         print(f'this node got a new connection')
 
-    def connect(self, send: bool = True):
-        """Connect to a peer"""
+    def connect(self, send: bool = True, address: tuple = None, priority: bool = True) -> bool:
+        """Connect to a peer
+        Args:
+            send (bool): ask the peer for a join_reply, only to enter the network
+            address (tuple): bind point of the peer, the anchorage point by default
+            priority (bool): the peer must accept the connection even if its active view is full
+        Returns:
+            bool: False if the peer couldn't be reached
+        """
+        address = address or self.connect_to
         try:
-            connection = socket.create_connection(self.connect_to)
+            connection = socket.create_connection(address, timeout=NETWORK_TIMEOUT)
+            self.peers[connection] = connection.getpeername()
+            self.detectors[connection] = PhiAccrualDetector(time.monotonic(), HEARTBEAT_INTERVAL)
             self.connection.add(connection)
 
-            print(f'this node connected to :{connection.getpeername()}')
+            print(f'this node connected to :{self.peers[connection]}')
             connection.setblocking(False)
             self.sel.register(connection, selectors.EVENT_READ, self.read)
 
             # create a bind point in the bind connections variable
-            self.bind_connections[connection.getpeername()] = connection.getpeername()
+            self.bind_connections[self.peers[connection]] = self.peers[connection]
+            self.update_ring()
 
             # send my join message
             ip = self.myip
             # print(f"hostname: {hostname}, ip: {ip}")
-            join_message = {"command":"join", "bindPoint": (self.myip, self._port), "reply": send, "ip": ip}
-            connection.sendall(json.dumps(join_message).encode())
+            join_message = CDProto.join((self.myip, self._port), send, ip, priority)
+            self.send(connection, join_message)
 
-            logging.info(f"{self.myip}:{self._port} connected to {self.connect_to}")
+            logging.info(f"{self.myip}:{self._port} connected to {address}")
+            return True
 
         except Exception as e:
             print(f'problema ao conectar!. Error : {e}')
+            return False
 
     def read(self, conn, mask):
         """Read incomming messages"""
         try:
-            data = conn.recv(1024)
+            data = conn.recv(BUFFER_SIZE)
 
             if data:
-                try:
-                    message = json.loads(data.decode())
-                    print(f'received message: {message}')
-
-                    self.keep_alive_nodes[conn] = True # set connection to true
-
-                    if message['command'] == 'join':
-                        # add the connection to the bind connections
-                        host, port = message['bindPoint']
-                        ip = message['ip']
-                        addr = (ip, int(port))
-                        self.bind_connections[conn.getpeername()] = addr
-
-                        peer_address = f"{ip}:{port}"
-
-                        self.network[f"{self.myip}:{self._port}"].append(peer_address)
-
-                        # verificar se seus dados em cache
-                        peer_data = self.network_cache.get(peer_address)
-
-                        # send the list of bind connections values 
-                        print(f"reply message: {message['reply']}")
-                        if message['reply']:
-                            copy_connections = self.bind_connections.copy()
-                            # remove the connection that is sending the message
-                            copy_connections.pop(conn.getpeername())
-                            bind_points = list(copy_connections.values())
-                            join_reply = {"command": "join_reply", 
-                                          "bindPoints": bind_points, 
-                                          "ip": self.myip,
-                                          "data": peer_data}
-                            
-                            conn.send(json.dumps(join_reply).encode())
-
-                        # imprime a lista de conexões atualizada
-                        print(f'this node connections: {self.bind_connections}')
-
-                        self.pool.submit(self.send_solve_on_join, conn)
-                
-                        logging.info(f"{self.myip}:{self._port} connected to {addr}")
-
-                    elif message['command'] == 'join_reply':
-                        print(f'received points to connect: {message["bindPoints"]}')
-
-                        # verificar se há dados no cache
-                        if message['data'] is not None:
-                            print(f"updating cache with: {message['data']}")
-                            self.solved = message['data']['solved']
-                            self.checked = message['data']['validations']
-
-                        
-                        # update peer ip
-                        ip = message['ip']
-                        peer = self.bind_connections[conn.getpeername()]
-                        self.bind_connections[conn.getpeername()] = (ip, peer[1])
-
-                        self.network[f"{self.myip}:{self._port}"].append(f"{ip}:{peer[1]}")
-
-                        # connect to the other nodes
-                        for node in message['bindPoints']:
-                            node = tuple(node)
-                            print(f'node: {node}')
-                            print(f'my connections: {self.bind_connections}')
-                            # check if hasn't connected to the node and port yet
-                            if node not in self.bind_connections.values() :
-
-                                self.connect_to = node
-                                self.connect(False)
-
-                        logging.info(f"{self.myip}:{self._port} received nodes list: {message['bindPoints']}")
-
-                    elif message['command'] == 'askToSolve':
-                        print(f"Recebido comando de resolução de sudoku: {message}")
-                        print(f"Asking for sudoku to solve")
-                        solve = {"command": "agToSolve"}
-                        conn.send(json.dumps(solve).encode())
-                    
-                    elif message['command'] == 'agToSolve':
-                        print(f"Recebido comando de confirmação para resolver")
-                        print(f"enviando sudoku para resolver")
-
-                        # ver se tem tarefas na fila
-                        if not self.mySodokuQueue.empty:
-                            task = self.mySodokuQueue.get()
-                            solve = {"command": "solve", "sudoku": task, "sudokuId": self.current_sudoku_id, "cache": self.mySodokuGrid.grid}
-                            conn.send(json.dumps(solve).encode())
-
-                            self.task_list[conn.getpeername()] = task
-                        
-                        elif len(self.task_list) > 0:
-                            # pegar o trabalho do outro nó
-                            task = self.task_list.popitem()[1]
-                            solve = {"command": "solve", "sudoku": task, "sudokuId": self.current_sudoku_id, "cache": self.mySodokuGrid.grid}
-                            conn.send(json.dumps(solve).encode())
-                            self.task_list[conn.getpeername()] = task
-                            print(f"Enviou task de outro nó")
-
-
-                    elif message['command'] == 'network':
-                        print(f"Recebido comando para enviar a rede")
-                        my_network_list = [f"{connection[0]}:{connection[1]}" for connection in self.bind_connections.values()]
-                        network = {"command": "update_network", "network": {f"{self.myip}:{self._port}": my_network_list}, "validations": self.checked}
-                        conn.send(json.dumps(network).encode())
-
-                    elif message['command'] == 'update_network':
-                        print(f"Recebido comando para atualizar a rede")
-                        peer_network = message['network']
-                        self.network.update(peer_network)
-                        print(f"network updated")
-
-
-                        self.network_count += 1
-                        if self.network_count == len(self.connection):
-                            self.network_event.set()
-                            self.network_count = 0
-
-                    elif message['command'] == 'solve':
-                        check_cache = message['cache']
-                        # check if the sudoku is in the cache
-                        check_cache = pickle.dumps(check_cache)
-                        if check_cache in self.sudoku_cache:
-                            print(f"Enviando sudoku salvo em cache")
-                            response = {"command": "solution", "sudoku": self.sudoku_cache[check_cache], "sudokuId": message['sudokuId'], "solution": True}
-                            conn.send(json.dumps(response).encode())
-                            return
-
-                        # store the sudoku id
-                        sudoku_id = message['sudokuId']
-                        self.sudokuIds[sudoku_id] = False
-
-                        # resolver em uma thread
-                        self.pool.submit(self.solve_sudoku, message, conn)
-
-
-                    elif message['command'] == 'solution':
-                        # print(f"Task list: {self.task_list}, queue: {list(self.mySodokuQueue.queue), self.mySodokuQueue.qsize()}")
-
-                        
-                        solved = message['solution']
-                        solvedId = message['sudokuId']
-                        print(f"Recebido solução: {solved} found {self.solution_found}")
-
-
-
-                        # remover o trabalho do nó
-                        if conn.getpeername() in self.task_list:
-                            self.task_list.pop(conn.getpeername())
-
-                        if solved and not self.solution_found and self.sudokuIds.get(solvedId) is False or self.solved_event.is_set() is False:
-                            # atualizar o sudoku com a solução
-                            self.mySodokuGrid.update_sudoku(message['sudoku'])
-                            self.solution_found = True
-                            self.sudokuIds[self.current_sudoku_id] = True
-                            self.solved_event.set()
-
-
-                        elif not solved and not self.mySodokuQueue.empty():
-
-                            print(f"Enviando sudoku para resolver")
-                            
-                            task = self.mySodokuQueue.get()
-                            solve = {"command": "solve", "sudoku": task, "sudokuId": self.current_sudoku_id, "cache": self.mySodokuGrid.grid}                            
-                            conn.send(json.dumps(solve).encode())
-
-                            self.task_list[conn.getpeername()] = task
-                        elif self.mySodokuQueue.empty():
-                            # ver se há mais de um nó a tentar resolver o sudoku
-                            if len(self.task_list) > 1:
-                                # pegar o trabalho do outro nó
-                                task = self.task_list.popitem()[1]
-                                solve = {"command": "solve", "sudoku": task, "sudokuId": self.current_sudoku_id, "cache": self.mySodokuGrid.grid}
-                                conn.send(json.dumps(solve).encode())
-                                self.task_list[conn.getpeername()] = task
-                                print(f"Enviou task de outro nó")
-
-                            elif len(self.task_list) == 1:
-                                # get the task from the other node
-                                task = self.task_list.popitem()[1]
-                                task_puzzle = task[1]
-
-                                # update the sudoku with the new puzzle
-                                self.mySodokuGrid.update_sudoku(task_puzzle)
-
-                                # generate new puzzles and add them to the queue
-                                new_puzzles = self.mySodokuGrid.generate_puzzles()
-                                for puzzle in new_puzzles:
-                                    self.mySodokuQueue.put(puzzle)
-                                
-                                # send the new puzzles to the other nodes that aint working rn
-                                for node in self.connection:
-                                    if node not in self.task_list.keys():
-                                        task = self.mySodokuQueue.get()
-                                        solve = {"command": "solve", "sudoku": task, "sudokuId": self.current_sudoku_id, "cache": self.mySodokuGrid.grid}
-                                        node.send(json.dumps(solve).encode())
-                                        self.task_list[node.getpeername()] = task
-
-                                print(f"Enviou novas tarefas para os outros nodes")
-
-
-                    elif message['command'] == 'stop':
-                        # parar a resolução do sudoku
-                        ID = message['sudokuId']
-                        if ID in self.sudokuIds:
-                            self.sudokuIds.pop(ID)
-
-                    elif message['command'] == 'keep_alive':
-                        IP = message['IP']
-                        IP_status = message['status']
-                        self.network_cache[IP] = IP_status
-
-                        # send reply
-                        reply_message = {"command": "keep_alive_reply"}
-                        send_message = json.dumps(reply_message).encode()
-                        conn.send(send_message)
-                    
-                    elif message['command'] == 'keep_alive_reply':
-                        # set connection to true
-                        self.keep_alive_nodes[conn] = True
-
-
-                except json.JSONDecodeError as e:
-                    print(f"Erro ao decodificar a mensagem JSON enviada por {conn}: {e}")
-                    # self.shutdown(signal.SIGINT, None)
+                # uma leitura pode ter várias mensagens, ou só parte de uma
+                for frame in self.readers.setdefault(conn, FrameReader()).feed(data):
+                    try:
+                        message = CDProto.decode(frame).to_dict()
+                    except CDProtoBadFormat:
+                        print(f"Erro ao decodificar a mensagem enviada por {conn}")
+                        continue
+
+                    self.handle_message(conn, message)
 
             else:
-                print(f'closing connection for:{conn.getpeername()}')
+                print(f'closing connection for:{self.peers.get(conn)}')
                 self.close_connection(conn)
 
         except ConnectionResetError:
-            print(f'conexão fechada abrumtamente por {conn.getpeername()}')
+            print(f'conexão fechada abrumtamente por {self.peers.get(conn)}')
+            self.close_connection(conn)
+
+        except CDProtoBadFormat:
+            print(f'mensagem inválida de {self.peers.get(conn)}, a fechar a conexão')
             self.close_connection(conn)
 
         except Exception as e:
@@ -358,8 +249,302 @@ class Server:
             # print(exc_type, fname, exc_tb.tb_lineno)
             # self.shutdown(signal.SIGINT, None)
 
+    def handle_message(self, conn, message):
+        """Process a message received from a node"""
+        print(f'received message: {message}')
+
+        # qualquer mensagem mostra que o node está vivo
+        detector = self.detectors.get(conn)
+        if detector is not None:
+            detector.heartbeat(time.monotonic())
+
+        if message['command'] == 'join':
+            # codificação a usar com este node, json se for um node antigo
+            self.encodings[conn] = CDProto.pick_encoding(message.get('encodings'))
+
+            # add the connection to the bind connections
+            host, port = message['bindPoint']
+            ip = message['ip']
+            addr = (ip, int(port))
+
+            # com a vista ativa cheia só se aceitam pedidos prioritários
+            if addr in self.active_view() or (not message.get('priority', True) and len(self.connection) >= ACTIVE_VIEW):
+                self.send(conn, CDProto.disconnect())
+                return
+
+            self.unjoined.discard(conn)
+            self.connection.add(conn)
+            self.detectors[conn] = PhiAccrualDetector(time.monotonic(), HEARTBEAT_INTERVAL)
+            self.bind_connections[self.peers.get(conn)] = addr
+            self.passive.discard(addr)
+            if len(self.connection) > ACTIVE_VIEW:
+                self.evict(conn)
+            self.update_ring()
+
+            peer_address = f"{ip}:{port}"
+
+            self.network[f"{self.myip}:{self._port}"].append(peer_address)
+
+            # verificar se seus dados em cache
+            peer_data = self.network_cache.get(peer_address)
+
+            # send the list of bind connections values 
+            print(f"reply message: {message['reply']}")
+            if message['reply']:
+                # nodes para a vista passiva do novo node
+                bind_points = self.sample(SHUFFLE_SIZE, addr)
+                join_reply = CDProto.join_reply(bind_points, self.myip, peer_data)
+                
+                self.send(conn, join_reply)
+
+                # espalhar o novo node pela rede
+                for node in list(self.connection):
+                    if node is not conn:
+                        self.send(node, CDProto.forward_join(addr, ACTIVE_WALK))
+            else:
+                # o node só precisa de saber as codificações que aceito
+                self.send(conn, CDProto.join_ack())
+
+            # imprime a lista de conexões atualizada
+            print(f'this node connections: {self.bind_connections}')
+
+            self.pool.submit(self.send_solve_on_join, conn)
+    
+            logging.info(f"{self.myip}:{self._port} connected to {addr}")
+
+        elif message['command'] == 'join_reply':
+            print(f'received points to connect: {message["bindPoints"]}')
+            self.encodings[conn] = CDProto.pick_encoding(message.get('encodings'))
+
+            # verificar se há dados no cache
+            if message['data'] is not None:
+                print(f"updating cache with: {message['data']}")
+                self.solved = message['data']['solved']
+                self.checked = message['data']['validations']
+                self.busy = message['data'].get('busy', 0.0)
+
+            
+            # update peer ip
+            ip = message['ip']
+            peer = self.bind_connections[self.peers.get(conn)]
+            self.bind_connections[self.peers.get(conn)] = (ip, peer[1])
+            self.update_ring()
+
+            self.network[f"{self.myip}:{self._port}"].append(f"{ip}:{peer[1]}")
+
+            # os outros nodes ficam na vista passiva, os forward_join trazem os vizinhos
+            self.add_passive(message['bindPoints'])
+
+            logging.info(f"{self.myip}:{self._port} received nodes list: {message['bindPoints']}")
+
+        elif message['command'] == 'join_ack':
+            self.encodings[conn] = CDProto.pick_encoding(message.get('encodings'))
+
+        elif message['command'] == 'askToSolve':
+            print(f"Recebido comando de resolução de sudoku: {message}")
+            print(f"Asking for sudoku to solve")
+            self.send(conn, CDProto.agree_to_solve(self.credit))
+        
+        elif message['command'] == 'agToSolve':
+            print(f"Recebido comando de confirmação para resolver")
+            print(f"enviando sudoku para resolver")
+
+            # ver se tem tarefas na fila, senão pedir a um nó ocupado
+            self.windows[conn] = message.get('credit', 1)
+            self.give_work(conn)
+
+
+        elif message['command'] == 'network':
+            print(f"Recebido comando para enviar a rede")
+            my_network_list = [f"{connection[0]}:{connection[1]}" for connection in self.bind_connections.values()]
+            network = CDProto.network_update({f"{self.myip}:{self._port}": my_network_list}, self.checked)
+            self.send(conn, network)
+
+        elif message['command'] == 'update_network':
+            print(f"Recebido comando para atualizar a rede")
+            peer_network = message['network']
+            self.network.update(peer_network)
+            print(f"network updated")
+
+
+            self.network_count += 1
+            if self.network_count >= len(self.connection):
+                self.network_event.set()
+                self.network_count = 0
+
+        elif message['command'] == 'solve':
+            sudoku_id = message['sudokuId']
+            first = sudoku_id not in self.sudokuIds
+
+            # store the sudoku id
+            self.sudokuIds[sudoku_id] = False
+            if sudoku_id not in self.cancel_tokens:
+                self.cancel_tokens[sudoku_id] = self.new_token()
+
+            if first and not message.get('hops'):
+                # a forma canónica demora, o cache é consultado fora do selector loop
+                self.pool.submit(self.check_cache, conn, message)
+            else:
+                self.receive_tasks(conn, message)
+
+
+        elif message['command'] == 'solution':
+            solved = message['solution']
+            job = self.jobs.get(message['sudokuId'])
+            print(f"Recebido solução: {solved}")
+
+            if job is None or job.finished:
+                # resposta de um sudoku que já foi resolvido
+                return
+
+            # a tarefa foi explorada toda sem solução
+            if not solved and message.get('nogood') is not None:
+                job.add_nogood(message['nogood'])
+
+            # o tempo da tarefa conta desde que o node acabou a anterior, as outras esperavam na fila
+            owner = self.peers.get(conn)
+            now = time.time()
+            entry = job.ledger.get(message.get('taskId'))
+            if entry is not None and entry[0] == owner:
+                self.speeds.task_done(self.node_address(conn), now - max(entry[1], self.last_result.get(conn, 0)))
+            self.last_result[conn] = now
+
+            # a primeira cópia a acabar ganha, a outra é parada
+            rival = job.drop_rival(owner, message.get('taskId'))
+            if rival is not None:
+                self.stop_copy(job, rival, message.get('taskId'))
+
+            # remover o trabalho do nó
+            exhausted = job.release(owner, message.get('taskId'))
+            self.windows[conn] = message.get('credit', self.windows.get(conn, 1))
+
+            if solved:
+                # atualizar o sudoku com a solução
+                self.finish_job(job, message['sudoku'])
+                return
+
+            if exhausted:
+                print("Sudoku sem solução")
+                self.finish_job(job, None)
+
+            # enviar outra tarefa, ou pedir parte do trabalho a um nó ocupado
+            self.give_work(conn)
+
+        elif message['command'] == 'steal':
+            # dar metade do trabalho que ainda não foi explorado
+            ID = message['sudokuId']
+            running = list(self.running.get(ID, []))
+            if not running:
+                self.send(conn, CDProto.steal_reply(ID, []))
+            else:
+                future = running[0].request_split()
+                future.add_done_callback(lambda f: self.send(conn, CDProto.steal_reply(ID, f.result())))
+
+        elif message['command'] == 'steal_reply':
+            job = self.jobs.get(message['sudokuId'])
+            if job is not None:
+                self.stolen(job, self.peers.get(conn), message['tasks'])
+
+        elif message['command'] == 'stop':
+            # parar a resolução do sudoku
+            ID = message['sudokuId']
+            if message.get('taskId') is not None:
+                # outro node acabou primeiro a cópia desta tarefa
+                self.stop_tasks(ID, message['taskId'])
+                return
+            if ID in self.sudokuIds:
+                self.sudokuIds.pop(ID)
+
+            # cancelar as threads que ainda estão a resolver
+            cancel = self.cancel_tokens.pop(ID, None)
+            if cancel is not None:
+                cancel.set()
+            self.stop_tasks(ID)
+            self.running.pop(ID, None)
+
+            # e os jobs criados para as suas tarefas
+            for job in list(self.delegated.pop(ID, ())):
+                self.finish_job(job, None, cancelled=True)
+
+        elif message['command'] == 'keep_alive':
+            IP = message['IP']
+            IP_status = message['status']
+            self.network_cache[IP] = IP_status
+            self.speeds.report(IP, IP_status.get('validations', 0), IP_status.get('busy'))
+
+            # send reply
+            self.send(conn, CDProto.keep_alive_reply())
+        
+        elif message['command'] == 'keep_alive_reply':
+            sent = self.pings.pop(conn, None)
+            if sent is not None and conn in self.detectors:
+                self.detectors[conn].rtt(time.monotonic() - sent)
+
+        elif message['command'] == 'forward_join':
+            node = tuple(message['bindPoint'])
+            ttl = message['ttl']
+            if node == (self.myip, self._port) or node in self.active_view():
+                return
+
+            # fim do caminho, ou não há a quem passar o node
+            others = [peer for peer in list(self.connection)
+                      if peer is not conn and self.bind_connections.get(self.peers.get(peer)) != node]
+            if ttl <= 0 or not others:
+                self.pool.submit(self.connect, False, node)
+                return
+
+            if ttl == PASSIVE_WALK:
+                self.add_passive([node])
+            self.send(random.choice(others), CDProto.forward_join(node, ttl - 1))
+
+        elif message['command'] == 'shuffle':
+            self.send(conn, CDProto.shuffle_reply(self.sample(SHUFFLE_SIZE, self.bind_connections.get(self.peers.get(conn)))))
+            self.add_passive(message['nodes'])
+
+        elif message['command'] == 'shuffle_reply':
+            self.add_passive(message['nodes'])
+
+        elif message['command'] == 'disconnect':
+            # o node tirou esta ligação da sua vista ativa
+            print(f"Desligado por {self.bind_connections.get(self.peers.get(conn))}")
+            self.close_connection(conn, refill=False)
+
+        elif message['command'] == 'gossip':
+            self.send(conn, CDProto.gossip_reply(self.members.digest()))
+            if self.members.merge(message['members'], time.monotonic()):
+                self.update_ring()
+
+        elif message['command'] == 'gossip_reply':
+            if self.members.merge(message['members'], time.monotonic()):
+                self.update_ring()
+
+        elif message['command'] == 'cache_lookup':
+            board = self.sudoku_cache.get_board(bytes.fromhex(message['key']))
+            solution = board_text(board) if board is not None else None
+            self.send(conn, CDProto.cache_lookup_reply(message['key'], solution))
+
+        elif message['command'] == 'cache_lookup_reply':
+            with self.cache_lock:
+                futures = self.cache_lookups.get(message['key'])
+                future = futures.pop(0) if futures else None
+            if future is not None:
+                future.set_result(message['solution'])
+
+        elif message['command'] == 'cache_store':
+            # guardar as soluções de que este node é dono
+            for key, solution in message['entries']:
+                try:
+                    self.sudoku_cache.put_board(bytes.fromhex(key), text_board(solution))
+                except (ValueError, TypeError):
+                    print(f"Solução inválida no cache_store: {key}")
+
+
     def sudoku_received(self, sudoku):
-        """processar o sudoku recibido por http"""
+        """processar o sudoku recibido por http
+        Args:
+            sudoku: o corpo de um POST /solve (dict), ou um comando do servidor http:
+                'stats', 'network', ('batch', sudokus), ('job', id, wait) ou ('cancel', id)
+        """
         print(f"Recebido uma requisição")
 
         endpoint = sudoku
@@ -375,22 +560,27 @@ class Server:
                       }
 
                 nodes = [{"address":f"{self.myip}:{self._port}",
-                          "validations": self.checked}]
+                          "validations": self.checked,
+                          "limiter": self.limiter,
+                          "outbox": self.outbox_depth(),
+                          "cache": {**self.sudoku_cache.stats(), "remote_hits": self.remote_hits}}]
+                speeds = self.speeds.stats()
+                if self.address in speeds:
+                    nodes[0]["throughput"] = speeds[self.address]
                 return_status['all']['solved'] += self.solved
                 return_status['all']['validations'] += self.checked
                 
-                for address, value in self.network_cache.items():
+                # todos os nodes do cluster, com os números da última tabela de membros recebida
+                for address, value in self.members.stats().items():
                     solved = value["solved"]
                     checked =  value["validations"]
-                    print(checked, solved)
                     return_status['all']['solved'] += solved
                     return_status['all']['validations'] += checked
 
-                    host, port = address.split(':')
-                    node = (host, int(port))
-                    if node not in self.bind_connections.values():
-                        continue
                     node = {"address": address, "validations": checked}
+                    if address in speeds:
+                        # estimativas dos vizinhos, usadas para dividir o trabalho
+                        node["throughput"] = speeds[address]
                     nodes.append(node)
 
                 return_status['nodes'] = nodes
@@ -401,97 +591,438 @@ class Server:
                 print(f"Endpoint: /{endpoint}")
 
                 if len(self.connection) == 0:
-                    return self.network
+                    return {**self.network, "suspicion": {}}
+
+                self.network_event.clear()
+                self.network_count = 0
 
                 # enviar mensagem para os outros nodes
-                for node in self.connection:
-                    network = {"command": "network"}
-                    node.send(json.dumps(network).encode())
+                for node in list(self.connection):
+                    self.send(node, CDProto.network())
 
                 # update my network list
-                my_network_list = [f"{connection[0]}:{connection[1]}" for connection in self.bind_connections.values()]
+                my_network_list = [f"{connection[0]}:{connection[1]}" for connection in list(self.bind_connections.values())]
                 self.network[f"{self.myip}:{self._port}"] = my_network_list
 
-                self.network_event.clear()
-                self.network_event.wait()
+                # não esperar para sempre por um node que não responde
+                self.network_event.wait(NETWORK_TIMEOUT)
 
-                return self.network
+                # suspeita deste node sobre cada vizinho
+                return {**self.network, "suspicion": self.suspicion()}
             
-            case _:
-
-                print(f"Endpoint: /solve")	
-                sudokuToSolve = sudoku['sudoku']
-                self.solution_found = False # procurando solução
-
-                # gerar um id para o sudoku
-                sudokuId = str(uuid.uuid4())
-                self.current_sudoku_id = sudokuId
-                self.sudokuIds[sudokuId] = False
-                self.mySodokuGrid = Sudoku(sudokuToSolve, base_delay=self._handicap)
-
-                check_cache = pickle.dumps(sudokuToSolve)
-                # check_cache = str(sudokuToSolve)
-                # verificar se o sudoku já foi resolvido
-                if check_cache not in self.sudoku_cache:
-                    self.sudoku_cache[check_cache] = []
-                else:
-                    print("Sudoku salvo em cache")
-                    self.solved += 1
-                    self.sudokuIds.pop(sudokuId)
+            # os comandos são tuplos, que um corpo json nunca é
+            case ('batch', puzzles):
+                print(f"Endpoint: /solve/batch")
+                return self.solve_batch(puzzles)
+
+            case ('job', sudokuId, timeout):
+                print(f"Endpoint: /jobs/{sudokuId}")
+                with self.job_lock:
+                    job = self.job_history.get(sudokuId)
+                if job is None:
+                    return None
+
+                # esperar pelo fim do job, no máximo JOB_WAIT_LIMIT segundos
+                if timeout:
+                    wait([job.future], timeout=min(timeout, JOB_WAIT_LIMIT))
+                return job.describe()
+
+            case ('cancel', sudokuId):
+                print(f"Endpoint: DELETE /jobs/{sudokuId}")
+                with self.job_lock:
+                    job = self.job_history.get(sudokuId)
+                if job is None:
+                    return None
+
+                # parar a resolução em todos os nodes
+                self.finish_job(job, None, cancelled=True)
+                return job.describe()
+
+            case dict():
+
+                print(f"Endpoint: /solve")		
+                job = self.submit(sudoku)
+
+                if sudoku.get('async'):
+                    # responder já com o id do job
+                    return job.describe()
 
-                    return self.sudoku_cache[check_cache]
+                print(f"Esperando resolução ... ")
+                # return the solved sudoku
+                return job.future.result()
 
-                # # generate puzzles
-                puzzles = self.mySodokuGrid.generate_puzzles()
 
-                if puzzles is None:
-                    print("Não há espaços vazios no sudoku")
-                    return self.mySodokuGrid.grid
+    def submit(self, sudoku) -> SolveJob:
+        """Start solving a sudoku
+        Args:
+            sudoku (dict): solve request
+        Returns:
+            SolveJob: the job, its future is set when the sudoku is solved
+        """
+        sudokuToSolve = sudoku['sudoku']
+
+        # gerar um id para o sudoku
+        sudokuId = str(uuid.uuid4())
+        solver = sudoku.get('solver', self._solver)
+        if solver not in SOLVERS:
+            print(f"Solver desconhecido: {solver}, a usar {self._solver}")
+            solver = self._solver
+        job = SolveJob(sudokuId, sudokuToSolve, solver, self.new_token())
+        self.remember(job)
+
+        # verificar se o sudoku já foi resolvido
+        key, transform = self.sudoku_cache.key(sudokuToSolve)
+        job.canonical = (key, transform)
+        board = self.sudoku_cache.get_board(key)
+        if board is not None:
+            print("Sudoku salvo em cache")
+            self.solved += 1
+            job.finish(transform.invert(board_grid(board)))
+            return job
+
+        # propagar as restrições antes de dividir o trabalho
+        # a propagação altera a grelha, o job guarda o sudoku como foi recebido
+        grid = Sudoku([row[:] for row in sudokuToSolve], base_delay=self._handicap)
+        consistent = grid.propagate()
+        job.grid = grid.grid
+
+        if consistent and not grid.get_empty_lines():
+            print("Sudoku resolvido por propagação")
+            solved = grid.check()
+            self.add_checks(grid.get_check_count(), grid.get_limiter_stats())
+            if not solved:
+                job.finish(None)
+                return job
+
+            self.cache_solution(job, grid.grid)
+            self.solved += 1
+            job.finish(grid.grid)
+            return job
+
+        # dividir o sudoku em tarefas para os nodes disponíveis
+        puzzles = grid.generate_puzzles(self.frontier_target()) if consistent else []
+
+        if not puzzles:
+            print("Sudoku sem solução")
+            job.finish(None)
+            return job
+
+        # perguntar aos nodes que guardam este sudoku no cache
+        board = self.remote_lookup(key)
+        if board is not None:
+            print("Sudoku salvo no cache de outro node")
+            self.remote_hits += 1
+            self.solved += 1
+            self.sudoku_cache.put_board(key, board)
+            job.finish(transform.invert(board_grid(board)))
+            return job
+
+        self.jobs[sudokuId] = job
+        self.cancel_tokens[sudokuId] = job.cancel
+
+        # add the puzzles to the queue
+        self.queue_tasks(job, puzzles)
+
+        # enviar as primeiras mensagens para os outros nodes
+        print(len(self.connection))
+        for node in list(self.connection):
+            self.send(node, CDProto.ask_to_solve())
+
+        print("Resolvendo sudoku...")
+        return job
+
+    def remember(self, job):
+        """Keep a job for GET /jobs/<id>, forgetting the oldest finished ones"""
+        with self.job_lock:
+            self.job_history[job.id] = job
+            if len(self.job_history) <= JOB_HISTORY:
+                return
+            for sudokuId, old in list(self.job_history.items()):
+                if old.finished:
+                    self.job_history.pop(sudokuId)
+                    if len(self.job_history) <= JOB_HISTORY:
+                        return
+
+    def finish_job(self, job, grid, cancelled: bool = False):
+        """Set the result of a job and stop the nodes still solving it
+        Args:
+            job (SolveJob): the job
+            grid (list): the solved sudoku, None if it has no solution
+            cancelled (bool): the job was cancelled
+        """
+        if not job.finish(grid, cancelled):
+            return
+
+        # parar a resolução local
+        self.jobs.pop(job.id, None)
+        self.cancel_tokens.pop(job.id, None)
+        job.cancel.set()
+        self.stop_tasks(job.id)
+        self.running.pop(job.id, None)
+
+        # enviar stop message para os nodes que receberam tarefas
+        for node in list(self.connection):
+            if self.peers.get(node) in job.helpers:
+                self.send(node, CDProto.stop(job.id))
+
+        # os nodes que estavam a resolver este sudoku ficam livres
+        for conn in list(self.connection):
+            if self.peers.get(conn) in job.task_list:
+                self.give_work(conn)
+
+        if grid is not None and job.parent is None:
+            # adiocioar o sudoku ao cache
+            self.cache_solution(job, grid)
+            self.solved += 1
+        print(f"Sudoku {job.status}\nTempo de execução: {time.time() - job.start_time} s")
+
+    def cache_solution(self, job, grid):
+        """Cache the solution of a job here and on the nodes that keep it in the cluster cache"""
+        key, transform = job.canonical or self.sudoku_cache.key(job.puzzle)
+        board = grid_board(transform.apply(grid))
+        if not self.sudoku_cache.put_board(key, board):
+            return
+        entries = [[key.hex(), board_text(board)]]
+        for address in self.ring.owners(key, CACHE_REPLICAS):
+            if address == self.address:
+                continue
+            conn = self.peer_connection(address)
+            if conn is not None:
+                self.send(conn, CDProto.cache_store(entries))
+            else:
+                self.pool.submit(self.direct, address, CDProto.cache_store(entries))
 
-                # add the puzzle to the queue
-                for puzzle in puzzles:
-                    self.mySodokuQueue.put(puzzle)
+    def remote_lookup(self, key: bytes) -> bytes | None:
+        """Ask the nodes that keep a key in the cluster cache for its solution
+        Returns:
+            bytes: the canonical solution, None if no node answered with it in CACHE_TIMEOUT
+        """
+        futures = []
+        with self.cache_lock:
+            for address in self.ring.owners(key, CACHE_REPLICAS):
+                if address == self.address:
+                    continue
+                future = Future()
+                futures.append(future)
+                conn = self.peer_connection(address)
+                if conn is not None:
+                    self.cache_lookups.setdefault(key.hex(), []).append(future)
+                    self.send(conn, CDProto.cache_lookup(key.hex()))
+                    continue
+
+                # o dono não é vizinho, perguntar numa ligação só para isso
+                lookup = self.pool.submit(self.direct, address, CDProto.cache_lookup(key.hex()), 'cache_lookup_reply', CACHE_TIMEOUT)
+                lookup.add_done_callback(lambda done, future=future: future.set_result((done.result() or {}).get('solution')))
+
+        board = None
+        pending = set(futures)
+        deadline = time.time() + CACHE_TIMEOUT
+        while pending and board is None:
+            done, pending = wait(pending, max(0, deadline - time.time()), FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    board = text_board(future.result()) if future.result() else board
+                except (ValueError, TypeError):
+                    print(f"Solução inválida no cache_lookup_reply: {key.hex()}")
+
+        # esquecer os pedidos sem resposta
+        with self.cache_lock:
+            waiting = self.cache_lookups.get(key.hex(), [])
+            for future in pending:
+                if future in waiting:
+                    waiting.remove(future)
+            if not waiting:
+                self.cache_lookups.pop(key.hex(), None)
+        return board
+
+    def peer_connection(self, address: str):
+        """Connection to the node listening on 'address', None if it is this node or isn't connected"""
+        for peer, (ip, port) in list(self.bind_connections.items()):
+            if f"{ip}:{port}" == address:
+                for conn in list(self.connection):
+                    try:
+                        if self.peers.get(conn) == peer:
+                            return conn
+                    except OSError:
+                        continue
+        return None
+
+    def update_ring(self):
+        """Rebuild the hash ring after a node joined or left the cluster, and hand the cached solutions to their new owners"""
+        nodes = self.members.live()
+        with self.ring_lock:
+            if nodes == self.ring.nodes:
+                return
+            old, self.ring = self.ring, HashRing(nodes)
+        print(f"Anel do cache: {sorted(nodes)}")
+        self.pool.submit(self.rebalance, old, self.ring)
+
+    def rebalance(self, old, ring):
+        """Send the solutions this node kept to the nodes that keep them now"""
+        moves = {} # address: entries
+        for key, board in self.sudoku_cache.items():
+            before = old.owners(key, CACHE_REPLICAS)
+            if self.address not in before:
+                continue
+            for address in ring.owners(key, CACHE_REPLICAS):
+                if address not in before:
+                    moves.setdefault(address, []).append([key.hex(), board_text(board)])
 
-                # enviar as primeiras mensagens para os outros nodes
-                print(len(self.connection))
-                if len(self.connection) > 0:
-                    for node in self.connection:
-                        solve = {"command": "askToSolve"}
-                        node.send(json.dumps(solve).encode())
-                
-                start_time = time.time()
-                print("Resolvendo sudoku...")
+        for address, entries in moves.items():
+            if address == self.address:
+                continue
+            conn = self.peer_connection(address)
+            print(f"Enviando {len(entries)} soluções para {address}")
+            for start in range(0, len(entries), CACHE_STORE_BATCH):
+                message = CDProto.cache_store(entries[start:start + CACHE_STORE_BATCH])
+                if conn is not None:
+                    self.send(conn, message)
+                else:
+                    self.direct(address, message)
 
-                # FIXME: criar um processo em uma thread para esse nó também participar da resolução
-                # pool = ThreadPoolExecutor(3)
-                self.pool.submit(self.self_solve, sudokuId)
+    def direct(self, address: str, message: Message, reply: str = None, timeout: float = NETWORK_TIMEOUT) -> dict | None:
+        """Send a message to a node outside the active view, on a connection closed right after
+        Args:
+            reply (str): command of the answer to wait for, None to wait for nothing
+        Returns:
+            dict: the answer, None if there is none
+        """
+        ip, port = address.rsplit(':', 1)
+        try:
+            with socket.create_connection((ip, int(port)), timeout=timeout) as conn:
+                CDProto.send_msg(conn, message)
+                if reply is None:
+                    # esperar que o node feche a ligação, senão a mensagem pode perder-se
+                    conn.shutdown(socket.SHUT_WR)
+                    while conn.recv(BUFFER_SIZE):
+                        pass
+                    return None
+
+                while (answer := CDProto.recv_msg(conn)) is not None:
+                    answer = answer.to_dict()
+                    if answer.get('command') == reply:
+                        return answer
+        except (OSError, CDProtoBadFormat) as e:
+            print(f"Erro ao contactar {address}: {e}")
+        return None
+
+
+    def solve_batch(self, puzzles):
+        """Solve a batch of sudokus, up to BATCH_WINDOW at the same time
+        Args:
+            puzzles (iterable): solve requests, read as they arrive
+        Yields:
+            dict: the index of a sudoku in the batch and its solution, as soon as it is solved
+        """
+        puzzles = enumerate(puzzles)
+        pending = {} # future: index
+        reading = True
+
+        while True:
+            while reading and len(pending) < BATCH_WINDOW:
+                index, puzzle = next(puzzles, (None, None))
+                if puzzle is None:
+                    reading = False
+                elif 'sudoku' not in puzzle:
+                    yield {"index": index, "error": puzzle.get('error', 'Missing sudoku')}
+                elif not valid_grid(puzzle['sudoku']):
+                    yield {"index": index, "error": 'Invalid sudoku: expected 9 rows of 9 digits from 0 to 9'}
+                else:
+                    pending[self.submit(puzzle).future] = index
 
-                print(f"Esperando resolução ... ")
-                self.solved_event.clear() # clear the event
-                self.solved_event.wait() # wait for the event to be set
-
-                # enviar stop message para os outros nodes
-                for node in self.connection:
-                    stop = {"command": "stop", "sudokuId": self.current_sudoku_id}
-                    node.send(json.dumps(stop).encode())
-
-                # adiocioar o sudoku ao cache
-                self.sudoku_cache[check_cache] = self.mySodokuGrid.grid
-                     
-
-                # clean the queue for this task dict
-                self.mySodokuQueue = queue.Queue() 
-                self.task_list.clear()
-
-                # resetar as variáveis              
-                self.sudokuIds.pop(sudokuId)
-                self.current_sudoku_id = None
-                self.solution_found = True
-                self.solved += 1
-                print(f"Sudoku Resolvido\nTempo de execução: {time.time() - start_time} s")
-                # return the solved sudoku
-                return self.mySodokuGrid.grid
+            if not pending:
+                return
 
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield {"index": pending.pop(future), "sudoku": future.result()}
+
+
+    def send(self, conn, message: Message):
+        """Queue a message to a node, the selector loop sends it
+        Args:
+            conn (socket): connection to the node
+            message (Message): the message, encoded as agreed with the node
+        """
+        if conn not in self.connection and conn not in self.unjoined:
+            return
+
+        frame = CDProto.frame(message.encode(self.encodings.get(conn, "json")))
+        self.last_sent[conn] = time.monotonic()
+        with self.outbox_lock:
+            self.outbox.setdefault(conn, deque()).append(frame)
+            wake = not self.dirty
+            self.dirty.add(conn)
+
+        if wake and threading.get_ident() != self.loop_thread:
+            try:
+                self.wakeup_send.send(b'\0')
+            except BlockingIOError:
+                pass # the loop is already going to wake up
+
+    def wakeup(self, sock, mask):
+        """Another thread queued messages, they are sent after the events"""
+        try:
+            sock.recv(BUFFER_SIZE)
+        except BlockingIOError:
+            pass
+
+    def flush(self, conn):
+        """Send the queued messages of a connection, as much as the socket takes
+        Small messages are joined and sent together, what isn't sent waits for EVENT_WRITE.
+        """
+        if conn not in self.connection and conn not in self.unjoined:
+            return
+
+        with self.outbox_lock:
+            pending = self.outbox.get(conn)
+            chunks = []
+            size = 0
+            while pending and size < SEND_BATCH:
+                chunks.append(pending.popleft())
+                size += len(chunks[-1])
+
+        if chunks:
+            data = b''.join(chunks)
+            try:
+                sent = conn.send(data)
+            except BlockingIOError:
+                sent = 0
+            except OSError as e:
+                # a conexão é fechada quando a leitura falhar
+                print(f'Erro ao enviar para {conn}: {e}')
+                with self.outbox_lock:
+                    pending.clear()
+                return
+
+            if sent < len(data):
+                with self.outbox_lock:
+                    pending.appendleft(data[sent:])
+
+        # esperar que o socket aceite mais dados se ainda houver mensagens
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if pending else selectors.EVENT_READ
+        key = self.sel.get_map().get(conn)
+        if key is not None and key.events != events:
+            self.sel.modify(conn, events, key.data)
+
+    def flush_dirty(self):
+        """Send the messages queued since the last events"""
+        with self.outbox_lock:
+            dirty, self.dirty = self.dirty, set()
+        for conn in dirty:
+            self.flush(conn)
+
+    def outbox_depth(self) -> dict:
+        """Messages waiting to be sent to each node"""
+        depth = {}
+        with self.outbox_lock:
+            for conn, pending in list(self.outbox.items()):
+                peer = self.bind_connections.get(self.peers.get(conn))
+                if peer is not None:
+                    depth[f"{peer[0]}:{peer[1]}"] = len(pending)
+        return depth
 
     def get_my_ip(self):
         """Get the ip address of the node"""
@@ -510,86 +1041,269 @@ class Server:
             return ip
 
    
-    def self_solve(self, puzzle_id):
-        """this node function to solve the sudoku"""
-
-        # enquanto a solução não for encontrada
-        while self.sudokuIds.get(puzzle_id) is False:
-            # get a task from the queue if there is any
-            if not self.mySodokuQueue.empty():
-                task = self.mySodokuQueue.get()
-            
-            elif len(self.task_list) > 0:
-                # pegar task na lista de tarefas
-                task = self.task_list.popitem()[1]
-                print(f"Peguei na lista de tarefas")
-  
-            
-            # add the task to the task list
-            self.task_list['self.socket'] = task
-            # print(f"Task list: {self.task_list}, queue: {list(self.mySodokuQueue.queue), self.mySodokuQueue.qsize()}")
+    def self_solve(self, worker='self.socket'):
+        """this node function to solve the tasks of its sudokus
+        Args:
+            worker (str): name of this local worker in the task lists
+        """
 
-            # start solving the sudoku
-            puzzle = task[1]
-            sudoku = Sudoku(puzzle, base_delay=self._handicap)
+        while True:
+            job, tasks = self.next_task(worker)
+            if job is None:
+                continue
+            (task_id, task), = tasks
 
-            print(f"Self solving ...")
-            solved = sudoku.solve_sudoku()
+            token = self.task_token(job.id, task_id)
+            if token is None:
+                # outro node acabou a cópia desta tarefa primeiro
+                continue
 
-            # update the checked count
-            self.checked += sudoku.get_check_count()
-            solution = self.sudokuIds.get(puzzle_id)
-            print(f"Self solution found: {solved}, checked: {self.checked}, puzzle solved: {solution}")
-            if solved and self.sudokuIds.get(puzzle_id) is False:
+            # start solving the sudoku
+            print(f"Self solving ...")
+            solved, grid, nogood = self.run_solver(task[1], job.solver, job.id, job.nogood_lists(), job.grid, token)
+            self.end_task(job.id, task_id)
+            if nogood is not None:
+                job.add_nogood(nogood)
+            rival = job.drop_rival(worker, task_id)
+            if rival is not None:
+                self.stop_copy(job, rival, task_id)
+            exhausted = job.release(worker, task_id)
+
+            print(f"Self solution found: {solved}, checked: {self.checked}, puzzle solved: {job.finished}")
+            if solved:
                 # atualizar o sudoku com a solução
-                self.mySodokuGrid.update_sudoku(sudoku.get_sudoku())
-                self.solved_event.set()
-                print(f"soltution found: {self.solution_found}")
+                self.finish_job(job, grid)
 
-                # update the sudokuid to true
-                self.sudokuIds[puzzle_id] = True
+            elif exhausted:
+                print("Sudoku sem solução")
+                self.finish_job(job, None)
 
-                break
+    def next_task(self, worker):
+        """Wait for a task of any sudoku, asking a busy node for work if there is none
+        Returns:
+            tuple: the job and a list with its task id and task, (None, []) if there is no task yet
+        """
+        with self.work_ready:
+            job, tasks = self.take_task(worker)
+            if job is None:
+                self.work_ready.wait(STEAL_INTERVAL)
+                job, tasks = self.take_task(worker)
+
+        if job is None:
+            # pedir parte do trabalho a um nó ocupado
+            self.steal_work(worker)
+        return job, tasks
+
+    def take_task(self, owner, count: int = 1):
+        """Take up to 'count' tasks of the oldest sudoku that has some queued"""
+        for job in list(self.jobs.values()):
+            tasks = job.take(owner, count)
+            if tasks:
+                return job, tasks
+            if job.emptied:
+                print("Sudoku sem solução")
+                self.finish_job(job, None)
+        return None, []
+    
 
-            elif solution is True or solution is None:
-                break
-            
+    def check_cache(self, conn, message):
+        """Answer a solve message from the cache, the first time a sudoku is received,
+        or queue its tasks if the sudoku isn't cached"""
+        cached = self.sudoku_cache.get(message['cache'])
+        if self.sudokuIds.get(message['sudokuId']) is None:
+            # o stop chegou durante a consulta ao cache
+            print("Thread terminada!")
+            return
+        if cached is not None:
+            print(f"Enviando sudoku salvo em cache")
+            response = CDProto.solution(cached, message['sudokuId'], True, message['tasks'][0][0], self.credit)
+            self.send(conn, response)
+            return
+        self.receive_tasks(conn, message)
+
+    def receive_tasks(self, conn, message):
+        """Queue the tasks of a solve message for the local workers"""
+        # resolver pela ordem de chegada
+        solver = message.get('solver', self._solver)
+        nogoods = message.get('nogoods') or []
+        hops = message.get('hops', 0)
+        for task_id, task in message['tasks']:
+            self.inbox.put((conn, message['sudokuId'], task_id, task, solver, nogoods, message['cache'], hops))
+
+    def solve_sudoku(self):
+        """solve the tasks sent by other nodes, in the order they arrived"""
+
+        while True:
+            conn, ID, task_id, sudokuTask, solver, nogoods, puzzle, hops = self.inbox.get()
+            if self.sudokuIds.get(ID) is None:
+                # o sudoku foi resolvido enquanto a tarefa esperava
+                print("Thread terminada!")
+                continue
 
-        
-        print(f"Self solve finished!")
-        return 
-    
+            # os nodes que o coordenador não alcança ajudam através deste node
+            if hops < MAX_HOPS and not self.delegated and self.delegate(conn, ID, task_id, sudokuTask, solver, puzzle, hops):
+                continue
 
-    def solve_sudoku(self, message, conn):
-        """solve sudoku
-        Args:
-            message (dict): message received
-            conn (socket): connection who sent the message
+            token = self.task_token(ID, task_id)
+            if token is None:
+                # outro node acabou a cópia desta tarefa primeiro
+                self.send(conn, CDProto.solution(sudokuTask[1], ID, False, task_id, self.credit))
+                continue
+
+            # try to solve the sudoku
+            print(f"Resolvendo task ...")
+            result, grid, nogood = self.run_solver(sudokuTask[1], solver, ID, nogoods, puzzle, token)
+            self.end_task(ID, task_id)
+
+            # Send message to the node if wasn't solved yet
+            if self.sudokuIds.get(ID) is not None:
+                print(f"Resolvido sudoku: {result}, checked: {self.checked}")
+                response = CDProto.solution(grid, ID, result, task_id, self.credit, nogood)
+                self.send(conn, response)
+            else:
+                print("Thread terminada!")
+
+    def delegates(self, sender) -> list:
+        """Neighbors that can help with a task sent by 'sender', none if this node reaches no node
+        the sender can't reach, as in a cluster where every node is connected to every other"""
+        neighbors = [conn for conn in list(self.connection)
+                     if conn is not sender and self.peers.get(conn) in self.bind_connections]
+        if len(self.members.live()) <= len(self.bind_connections) + 1:
+            return []
+        return neighbors
+
+    def delegate(self, conn, sudoku_id, task_id, task, solver, puzzle, hops) -> bool:
+        """Split a task sent by another node into a job coordinated by this node, so the neighbors
+        of this node help solving it. The result goes back to the sender when the job finishes.
+        Returns:
+            bool: False if the task should be solved here
         """
-        sudokuTask = message['sudoku']
-        ID = message['sudokuId']
-        checking_cell = tuple(sudokuTask[0])
+        neighbors = self.delegates(conn)
+        if not neighbors:
+            return False
+
+        grid = Sudoku([row[:] for row in task[1]], base_delay=self._handicap)
+        if not grid.propagate():
+            return False
+        puzzles = grid.generate_puzzles(self.frontier_target())
+        if puzzles is None or len(puzzles) < 2:
+            return False
+
+        job = SolveJob(str(uuid.uuid4()), task[1], solver, self.new_token())
+        job.grid = grid.grid
+        job.hops = hops + 1
+        job.parent = (conn, sudoku_id, task_id, assignments(task[1], puzzle))
+        self.delegated.setdefault(sudoku_id, set()).add(job)
+        job.future.add_done_callback(lambda future, job=job: self.delegation_done(job))
+        print(f"Tarefa {task_id} dividida em {len(puzzles)} para os vizinhos")
+
+        self.jobs[job.id] = job
+        self.cancel_tokens[job.id] = job.cancel
+        self.queue_tasks(job, puzzles)
+        for node in neighbors:
+            self.send(node, CDProto.ask_to_solve())
+        return True
+
+    def delegation_done(self, job):
+        """Send the result of a delegated task to the node that sent it"""
+        conn, sudoku_id, task_id, nogood = job.parent
+        jobs = self.delegated.get(sudoku_id, set())
+        jobs.discard(job)
+        if not jobs:
+            self.delegated.pop(sudoku_id, None)
+
+        if job.cancelled or self.sudokuIds.get(sudoku_id) is None:
+            return
+        grid = job.future.result()
+        if grid is not None:
+            self.send(conn, CDProto.solution(grid, sudoku_id, True, task_id, self.credit))
+        else:
+            self.send(conn, CDProto.solution(job.puzzle, sudoku_id, False, task_id, self.credit, nogood))
 
-        puzzle = sudokuTask[1]
-        sudoku = Sudoku(puzzle, base_delay=self._handicap)
+    def run_solver(self, puzzle, solver, sudoku_id, nogoods=(), base=None, cancel=None) -> tuple[bool, list[list[int]], list[int] | None]:
+        """Solve a task on this node, in a worker process if there is a process pool
+        Args:
+            nogoods (list): literals of the tasks of this sudoku that had no solution
+            base (list): grid the task was split from
+            cancel: token of the task, the token of the sudoku if None
+        Returns:
+            tuple: if the task was solved, the resulting grid and the nogood of the task
+                if it was fully explored without a solution
+        """
+        if cancel is None:
+            cancel = self.cancel_tokens.get(sudoku_id)
+        literals = assignments(puzzle, base)
+        start = time.monotonic()
+
+        if self.process_pool is not None:
+            future = self.process_pool.submit(solve_board, encode_board(puzzle), solver, self._handicap, cancel, nogoods)
+            solved, board, checks, limiter = future.result()
+            self.add_checks(checks, limiter, time.monotonic() - start)
+            explored = not solved and not (cancel is not None and cancel.is_set())
+            return solved, decode_board(board), literals if explored else None
+
+        sudoku = Sudoku(puzzle, base_delay=self._handicap, cancel=cancel, nogoods=nogoods)
+        running = self.running.setdefault(sudoku_id, [])
+        running.append(sudoku)
+        solved = sudoku.solve(solver)
+        running.remove(sudoku)
 
-        # try to solve the sudoku
-        print(f"Resolvendo task ...")
-        result = sudoku.solve_sudoku()
-        
         # update the checked count
-        self.checked += sudoku.get_check_count()
-        
-        # Send message to the node if wasn't solved yet
-        if self.sudokuIds.get(ID) is not None:
-            print(f"Resolvido sudoku: {result}, checked: {self.checked}")
-            response = {"command": "solution", "sudoku": sudoku.get_sudoku(), "sudokuId": ID, "solution": result}
-            conn.send(json.dumps(response).encode())
-        else:
-            print("Thread terminada!")
-        
-        return
+        self.add_checks(sudoku.get_check_count(), sudoku.get_limiter_stats(), time.monotonic() - start)
+        # só é um nogood se nenhuma parte foi dada a outro node
+        explored = not solved and not sudoku.cancelled and not sudoku.given_away
+        return solved, sudoku.get_sudoku(), literals if explored else None
+
+    def task_token(self, sudoku_id, task_id):
+        """Cancellation token of a task about to be solved, None if the task was already stopped"""
+        token = self.new_token()
+        with self.task_lock:
+            if (sudoku_id, task_id) in self.stopped_tasks:
+                self.stopped_tasks.discard((sudoku_id, task_id))
+                return None
+            self.task_tokens[(sudoku_id, task_id)] = token
+        return token
+
+    def end_task(self, sudoku_id, task_id):
+        """Forget the cancellation token of a task that was solved"""
+        with self.task_lock:
+            self.task_tokens.pop((sudoku_id, task_id), None)
+
+    def stop_tasks(self, sudoku_id, task_id=None):
+        """Stop the solver of a task, or of every task of a sudoku if task_id is None"""
+        with self.task_lock:
+            if task_id is None:
+                keys = [key for key in self.task_tokens if key[0] == sudoku_id]
+                self.stopped_tasks = {key for key in self.stopped_tasks if key[0] != sudoku_id}
+            else:
+                keys = [(sudoku_id, task_id)]
+                if keys[0] not in self.task_tokens:
+                    # ainda está na fila
+                    self.stopped_tasks.add(keys[0])
+            tokens = [self.task_tokens[key] for key in keys if key in self.task_tokens]
+        for token in tokens:
+            token.set()
+
+    def new_token(self):
+        """Create a cancellation token that works with the local workers"""
+        if self.process_pool is not None:
+            return self.manager.Event()
+        return threading.Event()
     
+    def frontier_target(self) -> int:
+        """Number of subproblems to split a sudoku into, more when some nodes are slower
+        than the others, so the tasks they get stay short"""
+        workers = sum(1 / self.speeds.weight(self.node_address(conn)) for conn in list(self.connection))
+        workers += self.local_workers / self.speeds.weight(self.address)
+        return round(workers * TASKS_PER_WORKER)
+
+    def add_checks(self, checks, limiter, seconds: float = 0.0):
+        """Add the validations made by a solver, and the seconds it ran, to this node stats"""
+        self.checked += checks
+        self.busy += seconds
+        for key, value in limiter.items():
+            self.limiter[key] += value
+
     def shutdown(self, signum, frame):
         """Shutdown server."""
 
@@ -600,81 +1314,355 @@ class Server:
             conn.close()
 
         self.http_server.server_close() # fechar o servidor http
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+            self.manager.shutdown()
         print("Server fechado.")
         sys.exit(0)
 
+    def active_view(self) -> set:
+        """Bind points of the nodes this node is connected to"""
+        return set(self.bind_connections.values())
+
+    def add_passive(self, nodes):
+        """Add bind points to the passive view, forgetting random ones over PASSIVE_VIEW"""
+        active = self.active_view() | {(self.myip, self._port)}
+        for node in nodes:
+            node = tuple(node)
+            if node not in active:
+                self.passive.add(node)
+        while len(self.passive) > PASSIVE_VIEW:
+            self.passive.discard(random.choice(list(self.passive)))
+
+    def sample(self, count: int, exclude: tuple = None) -> list:
+        """Random bind points known by this node, itself included, to send to 'exclude'"""
+        nodes = (self.active_view() | self.passive | {(self.myip, self._port)}) - {exclude}
+        return [list(node) for node in random.sample(list(nodes), min(count, len(nodes)))]
+
+    def evict(self, keep):
+        """Drop a random node of the active view to make room for 'keep'"""
+        others = [conn for conn in list(self.connection)
+                  if conn is not keep and self.peers.get(conn) in self.bind_connections]
+        if others:
+            # o node fecha a ligação quando receber o disconnect
+            self.send(random.choice(others), CDProto.disconnect())
+
+    def fill_active_view(self, exclude=()):
+        """Connect to a node of the passive view if the active view isn't full"""
+        with self.membership_lock:
+            candidates = list(self.passive - set(exclude))
+            while len(self.connection) < ACTIVE_VIEW and candidates:
+                node = candidates.pop(random.randrange(len(candidates)))
+                self.passive.discard(node)
+                # sem vizinhos o pedido tem de ser aceite
+                if self.connect(False, node, priority=not self.connection):
+                    return
+
+    def membership(self):
+        """Refill the active view and exchange passive view samples with a random neighbor"""
+        while True:
+            time.sleep(SHUFFLE_INTERVAL)
+            self.fill_active_view()
+
+            peers = [conn for conn in list(self.connection) if self.peers.get(conn) in self.bind_connections]
+            if peers:
+                peer = random.choice(peers)
+                nodes = self.sample(SHUFFLE_SIZE, self.bind_connections.get(self.peers.get(peer)))
+                self.send(peer, CDProto.shuffle(nodes))
+
     def keep_alive(self):
-        """Enviar uma mensagem periodica aos nodes para verificar se ainda estão conectados"""
+        """Send a keep_alive to the nodes that got nothing from this node lately and close the failed ones,
+        run by the selector loop twice per HEARTBEAT_INTERVAL"""
+        self.timers.schedule(HEARTBEAT_INTERVAL / 2, self.keep_alive)
+        now = time.monotonic()
+
+        for conn in list(self.connection):
+            detector = self.detectors.get(conn)
+            if detector is None:
+                continue
 
-        while True: 
-            
-            # skip if im alone
-            if len(self.connection) == 0:
-                time.sleep(5)
+            if detector.phi(now) > FAIL_PHI:
+                print(f"Conexão perdida com {conn}")
+                # remove it from the network
+                peer = self.bind_connections.get(self.peers.get(conn))
+                if peer is not None:
+                    self.network.pop(f"{peer[0]}:{peer[1]}", None)
+
+                self.close_connection(conn)
                 continue
 
-            print("Checking bros ...")
-            for conn in self.connection:
-                if conn != self.sock:
-                    message = {"command": "keep_alive",
-                               "status": {
-                                    "solved": self.solved, 
-                                    "validations": self.checked
-                                },
-                                 "IP": f"{self.myip}:{self._port}"
-                              }
-                    conn.send(json.dumps(message).encode())
-
-                    self.keep_alive_nodes[conn] = False
-                   
-
-            time.sleep(3)
-            # # check if the connection is still alive
-            for node, value in self.keep_alive_nodes.items():
-                if value is False:
-                    print(f"Conexão perdida com {node}")
-                    # remove it from the network
-                    peer = self.bind_connections[node.getpeername()]
-                    self.network.pop(f"{peer[0]}:{peer[1]}")
-
-                    self.close_connection(node)
+            # as outras mensagens já servem de heartbeat, as estatísticas vão de STATS_INTERVAL em STATS_INTERVAL
+            idle = now - self.last_sent.get(conn, 0) >= HEARTBEAT_INTERVAL
+            if idle or now - self.pings.get(conn, 0) >= STATS_INTERVAL:
+                self.pings[conn] = now
+                self.send(conn, CDProto.keep_alive(self.solved, self.checked, f"{self.myip}:{self._port}", self.busy))
+
+    def gossip(self):
+        """Count a heartbeat of this node, forget the nodes that stopped counting theirs and
+        exchange the membership table with a random neighbor, run by the selector loop every GOSSIP_INTERVAL"""
+        self.timers.schedule(GOSSIP_INTERVAL, self.gossip)
+        self.members.beat(self.solved, self.checked)
+        self.speeds.report(self.address, self.checked, self.busy)
+        if self.members.expire(time.monotonic()):
+            self.update_ring()
+
+        peers = [conn for conn in list(self.connection) if self.peers.get(conn) in self.bind_connections]
+        if peers:
+            self.send(random.choice(peers), CDProto.gossip(self.members.digest()))
+
+    def suspicion(self) -> dict:
+        """Suspicion of each node in the active view, as shown in /network"""
+        now = time.monotonic()
+        nodes = {}
+        for conn, detector in list(self.detectors.items()):
+            peer = self.bind_connections.get(self.peers.get(conn))
+            if peer is not None:
+                state = detector.describe(now)
+                state["suspected"] = state["phi"] > SUSPECT_PHI
+                nodes[f"{peer[0]}:{peer[1]}"] = state
+        return nodes
 
     def send_solve_on_join(self, conn):
         # ver se estou a resolver um puzzle no momento 
         time.sleep(0.5) # FIXME: verificar a abordagem de tempo
-        if not self.solution_found or not self.solved_event.is_set():
-            if not self.mySodokuQueue.empty():
-                task = self.mySodokuQueue.get()
-                solve = {"command": "solve", "sudoku": task, "sudokuId": self.current_sudoku_id, "cache": self.mySodokuGrid.grid}
-                conn.send(json.dumps(solve).encode())
-                self.task_list[conn.getpeername()] = task
-                print(f"Enviou sudoku para resolver")
-            elif len(self.task_list) > 0:
-                # pegar o trabalho do outro nó
-                task = self.task_list.popitem()[1]
-                solve = {"command": "solve", "sudoku": task, "sudokuId": self.current_sudoku_id, "cache": self.mySodokuGrid.grid}
-                conn.send(json.dumps(solve).encode())
-                self.task_list[conn.getpeername()] = task
-                print(f"Enviou task de outro nó")
-
-
-    def close_connection(self, conn):
-        """Close the connection."""
-        print(f'Closing connection for {self.bind_connections[conn.getpeername()]} ')
+        if self.jobs:
+            self.give_work(conn)
+
+    def give_work(self, conn):
+        """Send tasks to a node, or ask a busy node for work if the queues are empty"""
+        if self.send_task(conn):
+            print(f"Enviou sudoku para resolver")
+        elif not self.assigned(conn):
+            self.steal_work(conn)
+
+    def queue_tasks(self, job, tasks, owner=None):
+        """Queue tasks of a job and hand them to the idle nodes
+        Returns:
+            bool: True if the job has no work left
+        """
+        exhausted = job.add_tasks(tasks, owner)
+        self.dispatch()
+        return exhausted
+
+    def dispatch(self):
+        """Wake the local workers and hand the queued tasks to the idle nodes"""
+        with self.work_ready:
+            self.work_ready.notify_all()
+
+        for idle in list(self.idle_nodes):
+            if not self.send_task(idle):
+                break
+
+    def check_tasks(self):
+        """Queue again the tasks that other nodes didn't finish before their deadline,
+        and give copies of the slowest tasks to the idle nodes,
+        run by the selector loop every TASK_CHECK_INTERVAL"""
+        self.timers.schedule(TASK_CHECK_INTERVAL, self.check_tasks)
+        requeued = 0
+        for job in list(self.jobs.values()):
+            late = {}
+            for owner, task_id in job.expired():
+                late.setdefault(owner, []).append(task_id)
+            for owner, task_ids in late.items():
+                print(f"{len(task_ids)} tarefas de {owner} passaram o prazo")
+                requeued += job.requeue(owner, task_ids)
+            if job.emptied:
+                print("Sudoku sem solução")
+                self.finish_job(job, None)
+        if requeued:
+            self.dispatch()
+
+        # os nodes que continuam sem trabalho recebem cópias das tarefas mais demoradas
+        for conn in list(self.idle_nodes):
+            self.speculate(conn)
+
+    def send_task(self, conn) -> bool:
+        """Send queued tasks to a node, as many as its credit allows, in one message per sudoku
+        Returns:
+            bool: False if no task was sent
+        """
+        peer = self.peers.get(conn)
+        free = self.task_limit(conn) - self.assigned(conn)
+        sent = False
+        for job in list(self.jobs.values()):
+            if free <= 0:
+                break
+            tasks = job.take(peer, free)
+            if tasks:
+                self.send(conn, CDProto.solve(tasks, job.id, job.puzzle, job.solver, job.nogood_lists(), job.hops))
+                free -= len(tasks)
+                sent = True
+            elif job.emptied:
+                print("Sudoku sem solução")
+                self.finish_job(job, None)
+
+        if sent:
+            self.idle_nodes.discard(conn)
+        return sent
+
+    def speculate(self, conn) -> bool:
+        """Send an idle node copies of the tasks other nodes have been solving the longest,
+        the first copy to finish wins
+        Returns:
+            bool: False if no copy was sent
+        """
+        peer = self.peers.get(conn)
+        free = self.task_limit(conn) - self.assigned(conn)
+        sent = False
+        for job in list(self.jobs.values()):
+            if free <= 0:
+                break
+            tasks = job.speculate(peer, free)
+            if tasks:
+                print(f"{len(tasks)} tarefas atrasadas copiadas para {peer}")
+                self.send(conn, CDProto.solve(tasks, job.id, job.puzzle, job.solver, job.nogood_lists(), job.hops))
+                free -= len(tasks)
+                sent = True
+
+        if sent:
+            self.idle_nodes.discard(conn)
+        return sent
+
+    def stop_copy(self, job, rival, task_id):
+        """Stop the copy of a task that another node finished first"""
+        if isinstance(rival, str):
+            self.stop_tasks(job.id, task_id)
+            return
+        for conn in list(self.connection):
+            if self.peers.get(conn) == rival:
+                self.send(conn, CDProto.stop(job.id, task_id))
+
+    def task_limit(self, conn) -> int:
+        """Most tasks a node may have assigned, its credit scaled by its speed relative to the fastest node"""
+        credit = min(self.windows.get(conn, 1), MAX_CREDIT)
+        return max(1, round(credit * self.speeds.weight(self.node_address(conn))))
+
+    def node_address(self, conn) -> str | None:
+        """Address the node of a connection listens on, as 'ip:port'"""
+        bind = self.bind_connections.get(self.peers.get(conn))
+        return f"{bind[0]}:{bind[1]}" if bind is not None else None
+
+    def assigned(self, conn) -> int:
+        """Number of tasks a node has to solve for this node"""
+        peer = self.peers.get(conn)
+        return sum(job.assigned(peer) for job in list(self.jobs.values()))
+
+    def steal_work(self, idle):
+        """Ask the node that has been busy the longest for part of its work
+        Args:
+            idle (socket | str): connection waiting for work, or the name of a local worker
+        """
+        if not isinstance(idle, str):
+            self.idle_nodes.add(idle)
+            idle = self.peers.get(idle)
+
+        for job in list(self.jobs.values()):
+            for owner in list(job.task_list):
+                if owner == idle or owner in job.pending_steals:
+                    continue
+
+                if isinstance(owner, str):
+                    # local worker
+                    running = list(self.running.get(job.id, []))
+                    if not running:
+                        continue
+                    job.pending_steals.add(owner)
+                    future = running[0].request_split()
+                    future.add_done_callback(lambda f, job=job, owner=owner: self.stolen(job, owner, f.result()))
+                    return
+
+                for conn in list(self.connection):
+                    if self.peers.get(conn) == owner:
+                        job.pending_steals.add(owner)
+                        self.send(conn, CDProto.steal(job.id))
+                        return
+
+    def stolen(self, job, owner, tasks):
+        """Queue the work given away by a busy node and send it to the idle nodes"""
+        print(f"Recebeu {len(tasks)} tarefas de {owner}")
+        if self.queue_tasks(job, tasks, owner):
+            print("Sudoku sem solução")
+            self.finish_job(job, None)
+
+    def close_connection(self, conn, refill: bool = True):
+        """Close the connection.
+        Args:
+            refill (bool): replace the node in the active view with a node of the passive view
+        """
+        peer = self.peers.get(conn)
+        if conn in self.unjoined:
+            # ligação só para o cache, ou um join recusado, o node não estava na vista ativa
+            self.unjoined.discard(conn)
+            self.readers.pop(conn, None)
+            self.encodings.pop(conn, None)
+            with self.outbox_lock:
+                self.outbox.pop(conn, None)
+                self.dirty.discard(conn)
+            self.last_sent.pop(conn, None)
+            if conn in self.sel.get_map():
+                self.sel.unregister(conn)
+            conn.close()
+            self.peers.pop(conn, None)
+            return
+
+        print(f'Closing connection for {self.bind_connections.get(peer)} ')
         if conn in self.connection:
+            self.idle_nodes.discard(conn)
+            self.readers.pop(conn, None)
+            self.encodings.pop(conn, None)
+            self.windows.pop(conn, None)
+            with self.outbox_lock:
+                self.outbox.pop(conn, None)
+                self.dirty.discard(conn)
+            self.detectors.pop(conn, None)
+            self.last_sent.pop(conn, None)
+            self.pings.pop(conn, None)
+            self.last_result.pop(conn, None)
+            # as tarefas que o node tinha voltam para a fila
+            requeued = sum(job.requeue(peer) for job in list(self.jobs.values()))
+            # o resultado das tarefas que o node delegou já não tem a quem ir
+            for job in list(self.jobs.values()):
+                if job.parent is not None and job.parent[0] is conn:
+                    self.finish_job(job, None, cancelled=True)
             if conn in self.sel.get_map(): # check if socket is registered
                 self.sel.unregister(conn)
             self.connection.remove(conn)
-            self.bind_connections.pop(conn.getpeername())
+            address = self.bind_connections.pop(peer, None)
+            if address is not None:
+                self.speeds.forget(f"{address[0]}:{address[1]}")
+            self.update_ring()
             print('Connection closed for node')
             conn.close()
+            self.peers.pop(conn, None)
+            if requeued:
+                print(f"{requeued} tarefas de {peer} voltaram para a fila")
+                self.dispatch()
+
+            # o node passa para a vista passiva, e é substituído se a ligação falhou
+            if address is not None:
+                self.add_passive([address])
+            if refill:
+                self.pool.submit(self.fill_active_view, [address])
 
     def loop(self):
         """Loop indefinetely."""
         logging.info(f"Server is running on {self._host}:{self._port} http port: {self._http_port}")
 
-        # send keep alive message
-        self.pool.submit(self.keep_alive)
+        # send keep alive message, from the selector loop
+        self.timers.schedule(HEARTBEAT_INTERVAL, self.keep_alive)
+        # espalhar a tabela de membros do cluster
+        self.timers.schedule(GOSSIP_INTERVAL, self.gossip)
+        # voltar a distribuir as tarefas atrasadas
+        self.timers.schedule(TASK_CHECK_INTERVAL, self.check_tasks)
+        # manter a vista ativa e baralhar a vista passiva
+        self.pool.submit(self.membership)
+        # ler o cache guardado em disco
+        self.pool.submit(self.sudoku_cache.preload)
+
+        # local workers, solve the tasks of the sudokus sent to this node
+        for worker in range(self.local_workers):
+            self.pool.submit(self.self_solve, f"self.socket.{worker}")
+            self.pool.submit(self.solve_sudoku)
 
         # connect to another node
         if self.connect_to is not None:
@@ -684,14 +1672,23 @@ class Server:
         try:
             print('Sudoku server running ...')
             # start http server
-            server_http_thread = threading.Thread(target=self.http_server.serve_forever)
+            server_http_thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
             server_http_thread.start()
 
+            self.loop_thread = threading.get_ident()
             while True:
-                events = self.sel.select()
+                events = self.sel.select(self.timers.timeout())
                 for key, mask in events:
-                    callback = key.data
-                    callback(key.fileobj, mask)
+                    if mask & selectors.EVENT_WRITE:
+                        self.flush(key.fileobj)
+                    if mask & selectors.EVENT_READ:
+                        callback = key.data
+                        callback(key.fileobj, mask)
+
+                self.timers.run()
+
+                # enviar as mensagens que ficaram em fila
+                self.flush_dirty()
         
         except KeyboardInterrupt:
             self.shutdown(signal.SIGINT, None)
@@ -709,6 +1706,12 @@ if __name__ == "__main__":
     parser.add_argument("-s","--socket", default=7000, type=int, help="P2P port")
     parser.add_argument("-a","--anchorage", default=None, help="Anchorage point")
     parser.add_argument("-H","--handicap", default=1, type=int, help="Check function delay")
+    parser.add_argument("-S","--solver", default="bitmask", choices=list(SOLVERS), help="Solver engine")
+    parser.add_argument("-P","--processes", default=0, nargs="?", const=os.cpu_count(), type=int, help="Solve in worker processes (default: one per core)")
+    parser.add_argument("-F","--prefetch", default=2, type=int, help="Tasks queued on this node besides the ones being solved")
+    parser.add_argument("-C","--cache-file", default=None, help="File where the solved sudokus are kept between restarts")
+    parser.add_argument("--cache-entries", default=100000, type=int, help="Most sudokus kept in the cache")
+    parser.add_argument("--cache-size", default=16, type=float, help="Most megabytes used by the cache")
     # print(f"args: {parser.parse_args()}")
     args = parser.parse_args()
     # print(f"args: {args}")
@@ -723,6 +1726,7 @@ if __name__ == "__main__":
         anchorage = (host, int(port))
         # print(f"anchorage: {anchorage}")
 
-    node = Server('', socket_port, http_port, anchorage, handicap)
+    cache = SolutionCache(args.cache_entries, int(args.cache_size * 1024 * 1024), args.cache_file)
+    node = Server('', socket_port, http_port, anchorage, handicap, args.solver, args.processes, args.prefetch, cache)
     node.loop()
 
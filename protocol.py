@@ -1,8 +1,68 @@
 """Protocol for node - Computação Distribuida Final Project"""
 import json
+import struct
+import uuid
 from datetime import datetime
+from itertools import chain
+from operator import or_
 from socket import socket
 
+HEADER_SIZE = 4 # bytes of the length prefix of every message
+MAX_FRAME = 16 * 1024 * 1024 # larger messages are a broken stream
+
+ENCODINGS = ("binary", "json") # encodings this node accepts, preferred first
+GRID_SIZE = 41 # bytes of a packed sudoku, two cells per byte
+
+# first byte of the binary messages, json messages always start with '{'
+SOLVE, SOLUTION, KEEP_ALIVE = 1, 2, 3
+
+
+_HIGH = [num << 4 for num in range(16)]
+_PAIRS = [bytes((byte >> 4, byte & 15)) for byte in range(256)]
+
+
+def pack_grid(grid: list[list[int]]) -> bytes:
+    """Pack the 81 cells of a sudoku in 4 bits each"""
+    cells = bytes(chain.from_iterable(grid)) + b'\0'
+    return bytes(map(or_, map(_HIGH.__getitem__, cells[0::2]), cells[1::2]))
+
+
+def unpack_grid(data: bytes) -> list[list[int]]:
+    """Unpack a sudoku packed by pack_grid"""
+    cells = b''.join(map(_PAIRS.__getitem__, data))
+    return [list(cells[row * 9:row * 9 + 9]) for row in range(9)]
+
+
+def pack_id(sudokuId: str) -> bytes | None:
+    """The 16 bytes of a uuid sudoku id, None if it isn't a uuid"""
+    try:
+        return uuid.UUID(sudokuId).bytes
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+def pack_str(text: str) -> bytes:
+    data = text.encode('utf-8')
+    return bytes([len(data)]) + data
+
+
+def unpack_str(data: bytes, offset: int) -> tuple[str, int]:
+    """Returns the string at 'offset' and the offset after it"""
+    end = offset + 1 + data[offset]
+    return data[offset + 1:end].decode('utf-8'), end
+
+
+def pack_literals(literals) -> bytes:
+    """Pack the cell * 9 + digit - 1 literals of a nogood"""
+    return struct.pack(f"!H{len(literals)}H", len(literals), *literals)
+
+
+def unpack_literals(data: bytes, offset: int) -> tuple[list[int], int]:
+    """Returns the literals at 'offset' and the offset after them"""
+    count, = struct.unpack_from("!H", data, offset)
+    offset += 2
+    return list(struct.unpack_from(f"!{count}H", data, offset)), offset + 2 * count
+
 
 class Message:
     """Message Type."""
@@ -15,7 +75,7 @@ class Message:
 
 
     def toJson(self, dict: dict):
-        self._msg = json.dumps(dict)
+        self._msg = dict
 
 
     @property
@@ -24,86 +84,172 @@ class Message:
         return self._timestamp
     
 
-    def __str__(self):
+    def to_dict(self) -> dict:
+        """Fields of the message, as they are sent in json."""
         return self._msg
 
 
+    def to_binary(self) -> bytes | None:
+        """Binary form of the message, None if it only has the json one."""
+        return None
+
+
+    def encode(self, encoding: str = "json") -> bytes:
+        """Serialize the message in the encoding agreed with the peer."""
+        if encoding == "binary":
+            data = self.to_binary()
+            if data is not None:
+                return data
+        return json.dumps(self._msg).encode('utf-8')
+
+
+    def __str__(self):
+        return json.dumps(self._msg)
+
+
     
 class JoinMessage(Message):
     """Message to join the network."""
-    def __init__(self, bindPoint, reply, ip):
+    def __init__(self, bindPoint, reply, ip, priority=True, encodings=ENCODINGS):
         super().__init__("join")
         self.channel = bindPoint
         self.reply = reply
         self.ip = ip
+        self.priority = priority # a node with a full active view only accepts a high priority join
+        self.encodings = encodings
 
         # fzr a convertion para json
         msg = {
             "command": self.command,
             "bindPoint": self.channel,
-            "reply": self.channel,
-            "ip": self.channel,
+            "reply": self.reply,
+            "ip": self.ip,
+            "priority": self.priority,
+            "encodings": list(self.encodings),
         }
         self.toJson(msg)
-
-
-    def __str__(self):
-        return self._msg
     
 
 
 class JoinReply(Message):
     """Message with all needed info to join the network."""
-    def __init__(self, bindPoint, ip, data):
+    def __init__(self, bindPoints, ip, data, encodings=ENCODINGS):
         super().__init__("join_reply")
-        self.bindPoint = bindPoint
+        self.bindPoints = bindPoints
         self.ip = ip
         self.data = data
+        self.encodings = encodings
     
         msg = {
             "command": self.command,
-            "bindPoint": self.bindPoint,
+            "bindPoints": self.bindPoints,
             "data": self.data,
-            "ip": self.ip
+            "ip": self.ip,
+            "encodings": list(self.encodings),
         }
         self.toJson(msg)
 
     
-    def __str__(self):
-        return self._msg
+class JoinAck(Message):
+    """Message to accept a join that doesn't need a reply."""
+    def __init__(self, encodings=ENCODINGS):
+        super().__init__("join_ack")
+        self.encodings = encodings
+
+        msg = {
+            "command": self.command,
+            "encodings": list(self.encodings),
+        }
+        self.toJson(msg)
     
 
 class AskToSolve(Message):
     """Message to ask for avability to solve a sudoku."""
     def __init__(self):
-        super().__init__("agToSolve")
-    
+        super().__init__("askToSolve")
+
         msg = {
             "command": self.command
         }
         self.toJson(msg)
 
-    
-    def __str__(self):
-        return self._msg
-        
+
+class AgreeToSolve(Message):
+    """Message to say the node is available to solve a sudoku."""
+    def __init__(self, credit):
+        super().__init__("agToSolve")
+        self.credit = credit # tasks the node wants to have assigned
+
+        msg = {
+            "command": self.command,
+            "credit": self.credit
+        }
+        self.toJson(msg)
+
     
 class Solve(Message):
-    """Message to solve a subproblem."""
+    """Message to solve subproblems of a sudoku."""
 
-    def __init__(self, task, taskid):
+    def __init__(self, tasks, taskid, cache, solver, nogoods=(), hops=0):
         super().__init__("solve")
-        self.sudoku = task
+        self.tasks = tasks # [task id, [cell, grid]]
         self.taskid = taskid
+        self.cache = cache
+        self.solver = solver
+        self.nogoods = nogoods # assignments known to have no solution
+        self.hops = hops # times the tasks were delegated since the sudoku was split
 
         msg = {
             "command": self.command,
-            "sudoku": self.sudoku,
-            "sudokuId": self.taskid
+            "tasks": self.tasks,
+            "sudokuId": self.taskid,
+            "cache": self.cache,
+            "solver": self.solver,
+            "nogoods": [list(nogood) for nogood in self.nogoods],
+            "hops": self.hops
             }
 
         self.toJson(msg)
 
+    def to_binary(self) -> bytes | None:
+        sudokuId = pack_id(self.taskid)
+        if sudokuId is None:
+            return None
+        data = [struct.pack("!B16sB", SOLVE, sudokuId, len(self.tasks))]
+        for task_id, ((row, col), grid) in self.tasks:
+            data.append(struct.pack("!IBB", task_id, row, col))
+            data.append(pack_grid(grid))
+        data.append(pack_grid(self.cache))
+        data.append(pack_str(self.solver))
+        data.append(struct.pack("!H", len(self.nogoods)))
+        data.extend(map(pack_literals, self.nogoods))
+        data.append(struct.pack("!B", self.hops))
+        return b''.join(data)
+
+    @classmethod
+    def from_binary(cls, data: bytes):
+        _, sudokuId, count = struct.unpack_from("!B16sB", data)
+        offset = struct.calcsize("!B16sB")
+        tasks = []
+        for _ in range(count):
+            task_id, row, col = struct.unpack_from("!IBB", data, offset)
+            offset += struct.calcsize("!IBB")
+            tasks.append([task_id, [[row, col], unpack_grid(data[offset:offset + GRID_SIZE])]])
+            offset += GRID_SIZE
+        cache = unpack_grid(data[offset:offset + GRID_SIZE])
+        solver, offset = unpack_str(data, offset + GRID_SIZE)
+        nogoods = []
+        hops = 0
+        if offset < len(data):
+            count, = struct.unpack_from("!H", data, offset)
+            offset += 2
+            for _ in range(count):
+                nogood, offset = unpack_literals(data, offset)
+                nogoods.append(nogood)
+        if offset < len(data):
+            hops, = struct.unpack_from("!B", data, offset)
+        return cls(tasks, str(uuid.UUID(bytes=sudokuId)), cache, solver, nogoods, hops)
+
 class Network(Message):
     """Message to ask for the network connections."""
 
@@ -130,29 +276,69 @@ class NetworkUpdate(Message):
         self.toJson(msg)
 
 class Solution(Message):
-    """Message to send a solution to a sudoku."""
+    """Message to send the result of a subproblem."""
 
-    def __init__(self, sudoku, sudokuId, solution):
+    def __init__(self, sudoku, sudokuId, solution, taskId, credit, nogood=None):
         super().__init__("solution")
         self.sudoku = sudoku
         self.sudokuId = sudokuId
         self.solution = solution
+        self.taskId = taskId
+        self.credit = credit # tasks the node wants to have assigned
+        self.nogood = nogood # assignments of the task, if it was fully explored without a solution
 
         msg = {
             "command": self.command,
             "sudoku": self.sudoku,
             "sudokuId": self.sudokuId,
-            "solution": self.solution
+            "solution": self.solution,
+            "taskId": self.taskId,
+            "credit": self.credit,
+            "nogood": self.nogood
             }
 
         self.toJson(msg)
 
+    def to_binary(self) -> bytes | None:
+        sudokuId = pack_id(self.sudokuId)
+        if sudokuId is None or not self.sudoku:
+            return None
+        data = struct.pack("!B16s?IH", SOLUTION, sudokuId, self.solution, self.taskId, self.credit) + pack_grid(self.sudoku)
+        if self.nogood is not None:
+            data += pack_literals(self.nogood)
+        return data
+
+    @classmethod
+    def from_binary(cls, data: bytes):
+        _, sudokuId, solution, taskId, credit = struct.unpack_from("!B16s?IH", data)
+        offset = struct.calcsize("!B16s?IH")
+        sudoku = unpack_grid(data[offset:offset + GRID_SIZE])
+        offset += GRID_SIZE
+        nogood = unpack_literals(data, offset)[0] if offset < len(data) else None
+        return cls(sudoku, str(uuid.UUID(bytes=sudokuId)), solution, taskId, credit, nogood)
+
 class Stop(Message):
-    """Message to stop solving a sudoku."""
+    """Message to stop solving a sudoku, or only one of its tasks."""
 
-    def __init__(self, sudokuId):
+    def __init__(self, sudokuId, taskId=None):
         super().__init__("stop")
         self.sudokuId = sudokuId
+        self.taskId = taskId # None for every task of the sudoku
+
+        msg = {
+            "command": self.command,
+            "sudokuId": self.sudokuId,
+            "taskId": self.taskId
+            }
+
+        self.toJson(msg)
+
+class Steal(Message):
+    """Message to ask a busy node for part of its work."""
+
+    def __init__(self, sudokuId):
+        super().__init__("steal")
+        self.sudokuId = sudokuId
 
         msg = {
             "command": self.command,
@@ -161,50 +347,215 @@ class Stop(Message):
 
         self.toJson(msg)
 
+class StealReply(Message):
+    """Message with the subproblems given away by a busy node."""
+
+    def __init__(self, sudokuId, tasks):
+        super().__init__("steal_reply")
+        self.sudokuId = sudokuId
+        self.tasks = tasks
+
+        msg = {
+            "command": self.command,
+            "sudokuId": self.sudokuId,
+            "tasks": self.tasks
+            }
+
+        self.toJson(msg)
+
 class KeepAlive(Message):
     """Message to ask for node ping."""
 
-    def __init__(self, solved, validations, IP):
+    def __init__(self, solved, validations, IP, busy=0.0):
         super().__init__("keep_alive")
         self.solved = solved
         self.validations = validations
         self.IP = IP
+        self.busy = round(busy, 3) # seconds the solvers of the node ran
 
         msg = {
             "command": self.command,
             "status": {
                 "solved": self.solved,
                 "validations": self.validations,
+                "busy": self.busy,
             },
                 "IP": self.IP
             }
 
         self.toJson(msg)
 
+    def to_binary(self) -> bytes | None:
+        busy = struct.pack("!Q", round(self.busy * 1000))
+        return struct.pack("!BIQ", KEEP_ALIVE, self.solved, self.validations) + pack_str(self.IP) + busy
+
+    @classmethod
+    def from_binary(cls, data: bytes):
+        _, solved, validations = struct.unpack_from("!BIQ", data)
+        IP, offset = unpack_str(data, struct.calcsize("!BIQ"))
+        busy = 0.0
+        if offset < len(data):
+            # milissegundos
+            busy = struct.unpack_from("!Q", data, offset)[0] / 1000
+        return cls(solved, validations, IP, busy)
+
 class KeepAliveReply(Message):
     """Message to confirm node ping."""
 
-    def __init__(self, task, taskid):
+    def __init__(self):
         super().__init__("keep_alive_reply")
-        self.sudoku = task
-        self.taskid = taskid
 
         msg = {"command": self.command}
 
         self.toJson(msg)   
 
+class ForwardJoin(Message):
+    """Message spreading a new node through the network with a random walk."""
+
+    def __init__(self, bindPoint, ttl):
+        super().__init__("forward_join")
+        self.bindPoint = bindPoint
+        self.ttl = ttl
+
+        msg = {
+            "command": self.command,
+            "bindPoint": self.bindPoint,
+            "ttl": self.ttl
+            }
+
+        self.toJson(msg)
+
+class Shuffle(Message):
+    """Message with a sample of the nodes known by a node, to refresh the passive view."""
+
+    def __init__(self, nodes):
+        super().__init__("shuffle")
+        self.nodes = nodes
+
+        msg = {
+            "command": self.command,
+            "nodes": self.nodes
+            }
+
+        self.toJson(msg)
+
+class ShuffleReply(Message):
+    """Message answering a shuffle with a sample of the nodes known by the node."""
+
+    def __init__(self, nodes):
+        super().__init__("shuffle_reply")
+        self.nodes = nodes
+
+        msg = {
+            "command": self.command,
+            "nodes": self.nodes
+            }
+
+        self.toJson(msg)
+
+class Disconnect(Message):
+    """Message to remove the connection from the active view of the node."""
+
+    def __init__(self):
+        super().__init__("disconnect")
+
+        msg = {"command": self.command}
+
+        self.toJson(msg)
+
+class CacheLookup(Message):
+    """Message to ask a node that keeps a sudoku for its solution."""
+
+    def __init__(self, key):
+        super().__init__("cache_lookup")
+        self.key = key
+
+        msg = {
+            "command": self.command,
+            "key": self.key
+            }
+
+        self.toJson(msg)
+
+class CacheLookupReply(Message):
+    """Message with the cached solution of a sudoku, None if it isn't cached."""
+
+    def __init__(self, key, solution):
+        super().__init__("cache_lookup_reply")
+        self.key = key
+        self.solution = solution
+
+        msg = {
+            "command": self.command,
+            "key": self.key,
+            "solution": self.solution
+            }
+
+        self.toJson(msg)
+
+class CacheStore(Message):
+    """Message with solutions for the node to keep, as [key, solution] pairs."""
+
+    def __init__(self, entries):
+        super().__init__("cache_store")
+        self.entries = entries
+
+        msg = {
+            "command": self.command,
+            "entries": self.entries
+            }
+
+        self.toJson(msg)
+
+class Gossip(Message):
+    """Message with the membership table of a node, as address: [heartbeat, solved, validations]."""
+
+    def __init__(self, members):
+        super().__init__("gossip")
+        self.members = members
+
+        msg = {
+            "command": self.command,
+            "members": self.members
+            }
+
+        self.toJson(msg)
+
+class GossipReply(Message):
+    """Message answering a gossip with the membership table of the node."""
+
+    def __init__(self, members):
+        super().__init__("gossip_reply")
+        self.members = members
+
+        msg = {
+            "command": self.command,
+            "members": self.members
+            }
+
+        self.toJson(msg)
+
+
+# messages with a binary form, by their first byte
+BINARY_MESSAGES = {SOLVE: Solve, SOLUTION: Solution, KEEP_ALIVE: KeepAlive}
+
 class CDProto:
     """Computação Distribuida Protocol."""
 
     @classmethod
-    def join(cls, bindPoint, reply, ip):
+    def join(cls, bindPoint, reply, ip, priority=True):
         """Join the network."""
-        return JoinMessage(bindPoint, reply, ip)
+        return JoinMessage(bindPoint, reply, ip, priority)
     
     @classmethod
-    def join_reply(cls, bindPoint, ip, data):
+    def join_reply(cls, bindPoints, ip, data):
         """Reply to a join message."""
-        return JoinReply(bindPoint, ip, data)
+        return JoinReply(bindPoints, ip, data)
+
+    @classmethod
+    def join_ack(cls):
+        """Accept a join without a reply."""
+        return JoinAck()
     
     @classmethod
     def ask_to_solve(cls):
@@ -212,10 +563,15 @@ class CDProto:
         return AskToSolve()
     
     @classmethod
-    def solve(cls, task, taskid):
+    def agree_to_solve(cls, credit):
+        """Say this node is available to solve a sudoku."""
+        return AgreeToSolve(credit)
+
+    @classmethod
+    def solve(cls, tasks, taskid, cache, solver, nogoods=(), hops=0):
         """Solve a sudoku."""
-        return Solve(task, taskid)
-    
+        return Solve(tasks, taskid, cache, solver, nogoods, hops)
+
     @classmethod
     def network(cls):
         """Ask for the network connections."""
@@ -227,37 +583,123 @@ class CDProto:
         return NetworkUpdate(network, validations)
     
     @classmethod
-    def solution(cls, sudoku, sudokuId, solution):
+    def solution(cls, sudoku, sudokuId, solution, taskId, credit, nogood=None):
         """Send a solution to a sudoku."""
-        return Solution(sudoku, sudokuId, solution)
+        return Solution(sudoku, sudokuId, solution, taskId, credit, nogood)
+
+    @classmethod
+    def stop(cls, sudokuId, taskId=None):
+        """Stop solving a sudoku, or one of its tasks."""
+        return Stop(sudokuId, taskId)
     
     @classmethod
-    def stop(cls, sudokuId):
-        """Stop solving a sudoku."""
-        return Stop(sudokuId)
+    def steal(cls, sudokuId):
+        """Ask a busy node for part of its work."""
+        return Steal(sudokuId)
     
     @classmethod
-    def keep_alive(cls, solved, validations, IP):
+    def steal_reply(cls, sudokuId, tasks):
+        """Give away part of the work."""
+        return StealReply(sudokuId, tasks)
+    
+    @classmethod
+    def keep_alive(cls, solved, validations, IP, busy=0.0):
         """Ask for node ping."""
-        return KeepAlive(solved, validations, IP)
+        return KeepAlive(solved, validations, IP, busy)
     
     @classmethod
-    def keep_alive_reply(cls, task, taskid):
+    def keep_alive_reply(cls):
         """Confirm node ping."""
-        return KeepAliveReply(task, taskid)
+        return KeepAliveReply()
+
+    @classmethod
+    def forward_join(cls, bindPoint, ttl):
+        """Spread a new node through the network."""
+        return ForwardJoin(bindPoint, ttl)
+
+    @classmethod
+    def shuffle(cls, nodes):
+        """Send a sample of the known nodes."""
+        return Shuffle(nodes)
+
+    @classmethod
+    def shuffle_reply(cls, nodes):
+        """Answer a shuffle with a sample of the known nodes."""
+        return ShuffleReply(nodes)
+
+    @classmethod
+    def disconnect(cls):
+        """Leave the active view of a node."""
+        return Disconnect()
+
+    @classmethod
+    def cache_lookup(cls, key):
+        """Ask for the cached solution of a sudoku."""
+        return CacheLookup(key)
+
+    @classmethod
+    def cache_lookup_reply(cls, key, solution):
+        """Send the cached solution of a sudoku."""
+        return CacheLookupReply(key, solution)
+
+    @classmethod
+    def cache_store(cls, entries):
+        """Send solutions for a node to keep."""
+        return CacheStore(entries)
+
+    @classmethod
+    def gossip(cls, members):
+        """Send the membership table of this node."""
+        return Gossip(members)
+
+    @classmethod
+    def gossip_reply(cls, members):
+        """Answer a gossip with the membership table of this node."""
+        return GossipReply(members)
 
     @classmethod
-    def send_msg(cls, connection: socket, msg: Message):
+    def pick_encoding(cls, encodings) -> str:
+        """The encoding to send to a peer that accepts 'encodings'."""
+        for encoding in ENCODINGS:
+            if encoding in (encodings or ()):
+                return encoding
+        return "json"
+
+    @classmethod
+    def frame(cls, data: bytes) -> bytes:
+        """Prefix an encoded message with its length."""
+        return len(data).to_bytes(HEADER_SIZE, byteorder="big") + data
+
+    @classmethod
+    def decode(cls, data: bytes) -> Message:
+        """Decode a message received in json or in binary."""
+        if data[:1] == b'{':
+            # NOTE: tentar fazer o parse da mensagem
+            try:
+                encodedMsg = json.loads(data)
+                msg = Message(encodedMsg["command"])
+            except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+                raise CDProtoBadFormat(data)
+            msg.toJson(encodedMsg)
+            return msg
+
+        message = BINARY_MESSAGES.get(data[0]) if data else None
+        if message is None:
+            raise CDProtoBadFormat(data)
+        try:
+            return message.from_binary(data)
+        except (struct.error, ValueError, IndexError):
+            raise CDProtoBadFormat(data)
+
+    @classmethod
+    def send_msg(cls, connection: socket, msg: Message, encoding: str = "json"):
         """Sends through a connection a Message object."""
 
-        convertedMsg = msg.__str__().encode('utf-8')
-        msgLen = len(convertedMsg)  # NOTE: definir o tamanho da mensagem
-        
-        header = msgLen.to_bytes(2, byteorder="big")
+        convertedMsg = msg.encode(encoding)
         try:
             # tentar enviar a mensagem
             # NOTE: o send all é para garantir que a mensagem é enviada toda de uma vez
-            connection.sendall(header + convertedMsg)
+            connection.sendall(cls.frame(convertedMsg))
         except BrokenPipeError:
             raise CDProtoBadFormat(convertedMsg)
 
@@ -266,45 +708,56 @@ class CDProto:
         """Receives through a connection a Message object."""
 
         
-        header = connection.recv(2)
+        header = cls._recv_exactly(connection, HEADER_SIZE)
         msgLen = int.from_bytes(header, "big") # NOTE: convereter os bytes para int
 
         if not msgLen:
             # NOTE: se a mensagem não tiver tamanho, então não é uma mensagem válida
             return None
         
-        msg = connection.recv(msgLen).decode('utf-8')
-        
         # NOTE: tentar decodificar a mensagem
-        try:
-            # NOTE: tentar fazer o parse da mensagem
-            encodedMsg = json.loads(msg)
-        except json.JSONDecodeError:
-            raise CDProtoBadFormat(msg)
-
-        if encodedMsg["command"] == "join":
-            return JoinMessage(encodedMsg["bindPoint"], encodedMsg["reply"], encodedMsg["ip"])
-        elif encodedMsg["command"] == "join_reply":
-            return JoinReply(encodedMsg["bindPoint"], encodedMsg["ip"], encodedMsg["data"])
-        elif encodedMsg["command"] == "ask_to_solve":
-            return AskToSolve()
-        elif encodedMsg["command"] == "solve":
-            return Solve(encodedMsg["sudoku"], encodedMsg["sudokuId"])
-        elif encodedMsg["command"] == "network":
-            return Network()
-        elif encodedMsg["command"] == "update_network":
-            return NetworkUpdate(encodedMsg["network"], encodedMsg["validations"])
-        elif encodedMsg["command"] == "solution":
-            return Solution(encodedMsg["sudoku"], encodedMsg["sudokuId"], encodedMsg["solution"])
-        elif encodedMsg["command"] == "stop":
-            return Stop(encodedMsg["sudokuId"])
-        elif encodedMsg["command"] == "keep_alive":
-            return KeepAlive(encodedMsg["status"]["solved"], encodedMsg["status"]["validations"], encodedMsg["IP"])
-        elif encodedMsg["command"] == "keep_alive_reply":
-            return KeepAliveReply(encodedMsg["sudoku"], encodedMsg["sudokuId"])
-        
-        else:
-            raise CDProtoBadFormat(msg)
+        return cls.decode(cls._recv_exactly(connection, msgLen))
+
+    @classmethod
+    def _recv_exactly(cls, connection: socket, size: int) -> bytes:
+        """Receives 'size' bytes, less only if the connection is closed."""
+        data = b''
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+
+class FrameReader:
+    """Splits the bytes received from a connection into messages.
+
+    Every message is prefixed with its length in HEADER_SIZE big endian
+    bytes. A message that is still incomplete stays in the buffer until
+    the rest of it arrives.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """Add received bytes, returns the messages they completed."""
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        start = 0
+        while len(buffer) - start >= HEADER_SIZE:
+            size = int.from_bytes(buffer[start:start + HEADER_SIZE], "big")
+            if size > MAX_FRAME:
+                raise CDProtoBadFormat(bytes(buffer[start:start + HEADER_SIZE]))
+            end = start + HEADER_SIZE + size
+            if len(buffer) < end:
+                break
+            frames.append(bytes(buffer[start + HEADER_SIZE:end]))
+            start = end
+        del buffer[:start]
+        return frames
 
 
 class CDProtoBadFormat(Exception):
@@ -317,4 +770,4 @@ class CDProtoBadFormat(Exception):
     @property
     def original_msg(self) -> str:
         """Retrieve original message as a string."""
-        return self._original.decode("utf-8")
\ No newline at end of file
+        return self._original.decode("utf-8")
@@ -0,0 +1,33 @@
+'''Consistent hash ring'''
+import bisect
+import hashlib
+
+VIRTUAL_NODES = 64 # points of each node on the ring
+
+
+def ring_hash(data: bytes) -> int:
+    """Position of some data on the ring"""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), byteorder="big")
+
+
+class HashRing:
+    """Nodes placed on a ring of hashes, a key belongs to the first nodes after it"""
+
+    def __init__(self, nodes=(), vnodes: int = VIRTUAL_NODES):
+        self.nodes = frozenset(nodes)
+        points = sorted((ring_hash(f"{node}#{i}".encode()), node) for node in self.nodes for i in range(vnodes))
+        self.hashes = [point for point, _ in points]
+        self.points = [node for _, node in points]
+
+    def owners(self, key: bytes, count: int = 1) -> list[str]:
+        """The 'count' different nodes that keep a key, the first one is its primary"""
+        owners = []
+        count = min(count, len(self.nodes))
+        start = bisect.bisect(self.hashes, ring_hash(key))
+        for i in range(len(self.points)):
+            if len(owners) == count:
+                break
+            node = self.points[(start + i) % len(self.points)]
+            if node not in owners:
+                owners.append(node)
+        return owners
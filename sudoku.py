@@ -1,18 +1,52 @@
 import time
+import threading
 from collections import deque
+from concurrent.futures import Future
 
 from pprint import pprint
-from copy import deepcopy
+
+from dlx import DancingLinks, sudoku_matrix
+
+
+ALL_DIGITS = 0b1111111110 # bits 1..9
+BOX = [[3 * (r // 3) + c // 3 for c in range(9)] for r in range(9)]
+
+# cells as flat indices (row * 9 + col)
+UNITS = (
+    [[r * 9 + c for c in range(9)] for r in range(9)]
+    + [[r * 9 + c for r in range(9)] for c in range(9)]
+    + [[(br + i) * 9 + bc + j for i in range(3) for j in range(3)] for br in (0, 3, 6) for bc in (0, 3, 6)]
+)
+PEERS = [
+    sorted({p for unit in UNITS if i in unit for p in unit} - {i}) for i in range(81)
+]
+
+
+CANCEL_INTERVAL = 64 # calls to _limit_calls between cancellation checks
+
+
+class Cancelled(Exception):
+    """Raised inside a solver when its cancellation token is set."""
 
 
 class Sudoku:
-    def __init__(self, sudoku, base_delay=0.01, interval=10, threshold=5):
+    def __init__(self, sudoku, base_delay=0.01, interval=10, threshold=5, cancel=None, nogoods=()):
         self.grid = sudoku
+        self.cancel = cancel # threading.Event set to stop the solver
+        self.cancelled = False
+        self.nogoods = nogoods # literal lists (see assignments()) with no solution, pruned by solve_bitmask
+        self.given_away = 0 # subproblems handed out by request_split
+        self._watch = {} # literal: nogoods that have it, see _init_nogoods()
         self.recent_requests = deque()
         self.check_count = 0
         self.base_delay = base_delay
         self.interval = interval
         self.threshold = threshold
+        self.limiter_overhead = 0.0 # seconds spent in _limit_calls bookkeeping
+        self.limiter_delay = 0.0 # seconds slept by _limit_calls
+        self._engine = None # engine running in solve()
+        self._split_requests = deque()
+        self._split_lock = threading.Lock()
 
     def _limit_calls(self, base_delay=0.01, interval=10, threshold=5):
         """Limit the number of requests made to the Sudoku object."""
@@ -23,17 +57,27 @@ class Sudoku:
         if threshold is None:
             threshold = self.threshold
 
+        start = time.perf_counter()
         current_time = time.time()
-        self.recent_requests.append(current_time)
-        num_requests = len(
-            [t for t in self.recent_requests if current_time - t < interval]
-        )
+        recent = self.recent_requests
+        recent.append(current_time)
+        # sliding window: drop the requests that left the interval
+        while current_time - recent[0] >= interval:
+            recent.popleft()
+        num_requests = len(recent)
+        self.limiter_overhead += time.perf_counter() - start
 
         if num_requests > threshold:
             delay = base_delay * (num_requests - threshold + 1) # TODO: * o handicap ?
-            time.sleep(delay)
+            if self.cancel is None:
+                time.sleep(delay)
+            elif self.cancel.wait(delay):
+                raise Cancelled()
+            self.limiter_delay += delay
 
         self.check_count += 1
+        if self.cancel is not None and self.check_count % CANCEL_INTERVAL == 0 and self.cancel.is_set():
+            raise Cancelled()
 
     def __str__(self):
         string_representation = "| - - - - - - - - - - - |\n"
@@ -173,6 +217,11 @@ class Sudoku:
         return self.check_count
     
 
+    def get_limiter_stats(self) -> dict:
+        """Returns the time spent by the call limiter."""
+        return {"overhead": self.limiter_overhead, "delay": self.limiter_delay}
+    
+
     def update_cell(self, row, col, value):
         self.grid[row][col] = value
     
@@ -247,25 +296,85 @@ class Sudoku:
     #     return possible_puzzles
     
 
-    def generate_puzzles(self):
-        """Generates all possible puzzles for a specific cell"""
+    def generate_puzzles(self, target: int = None):
+        """Splits the puzzle breadth-first into subproblems.
 
-        
-        possible_puzzles = []
-        r, c = self.find_next_empty()
-        if r is None:
+        Each split branches on the most constrained empty cell, using only its
+        valid candidates. The root is always split; splitting goes on until
+        there are at least 'target' subproblems or nothing left to split.
+        Returns None if there are no empty cells, [] if the puzzle has no solution.
+        """
+        if self.find_next_empty() == (None, None):
             return None
 
-        puzzle = deepcopy(self.get_sudoku())
-        # print(r, c)
-        for i in range(1, 10):
-            new_puzzle = puzzle.copy()
-            new_puzzle[r][c] = i
-            # pprint(new_puzzle)
-            possible_puzzles.append(((r,c), deepcopy(new_puzzle)))
-                        
-        return possible_puzzles
-    
+        frontier = deque([(None, self.grid)])
+        leaves = [] # complete grids, can't be split further
+        while frontier:
+            if frontier[0][0] is not None and len(frontier) + len(leaves) >= (target or 0):
+                break
+
+            parent_cell, puzzle = frontier.popleft()
+            cell, nums = self.branch(puzzle)
+            if cell is None:
+                leaves.append((parent_cell, puzzle))
+                continue
+
+            r, c = cell
+            for num in nums:
+                new_puzzle = [row[:] for row in puzzle]
+                new_puzzle[r][c] = num
+                frontier.append(((r, c), new_puzzle))
+
+        return list(frontier) + leaves
+
+
+    def branch(self, puzzle) -> tuple[tuple[int, int], list[int]]:
+        """Returns the empty cell of 'puzzle' with fewest candidates and its candidates.
+
+        Returns (None, None) if the puzzle has no empty cells.
+        """
+        best, best_nums = None, None
+        for r in range(9):
+            for c in range(9):
+                if puzzle[r][c] == 0:
+                    nums = self.possible_numbers(puzzle, r, c)
+                    if best is None or len(nums) < len(best_nums):
+                        best, best_nums = (r, c), nums
+                        if len(nums) <= 1:
+                            return best, best_nums
+        return best, best_nums
+
+
+    def solve(self, engine="bitmask"):
+        """Solves the Sudoku puzzle with the given solver engine."""
+        self._engine = engine
+        try:
+            return getattr(self, SOLVERS[engine])()
+        except Cancelled:
+            self.cancelled = True
+            return False
+        finally:
+            with self._split_lock:
+                self._engine = None
+                while self._split_requests:
+                    self._split_requests.popleft().set_result([])
+
+
+    def request_split(self) -> Future:
+        """Asks the running solver to give away half of its unexplored work.
+
+        The future is resolved with a list of ((row, col), puzzle) subproblems
+        the next time the solver reaches a safe point, or with [] if the
+        solver can't be split.
+        """
+        future = Future()
+        with self._split_lock:
+            if self._engine not in SPLITTABLE:
+                future.set_result([])
+            else:
+                self._split_requests.append(future)
+        return future
+
 
     def solve_sudoku(self):
         if self.check():
@@ -286,9 +395,346 @@ class Sudoku:
                 self.grid[row][col] = 0
         
         return False
+
+
+    def solve_bitmask(self, base_delay=None, interval=None, threshold=None) -> bool:
+        """Solves the Sudoku keeping row/column/box candidate bitmasks.
+
+        Branches on the empty cell with the fewest candidates (MRV) and only
+        calls check() once, on the final grid.
+        """
+        if not self._init_masks() or not self._init_nogoods():
+            return False
+
+        cells, frames = self._cells, self._frames
+        depth = 0
+        while True:
+            # safe point: every placed cell matches the masks
+            if self._split_requests:
+                self._serve_splits(depth)
+
+            if depth == len(cells):
+                return self.check(base_delay, interval, threshold)
+
+            # new level: choose the most constrained cell
+            if len(frames) == depth:
+                frames.append(self._pick_cell(depth))
+
+            mask = frames[depth]
+            if mask:
+                bit = mask & -mask
+                frames[depth] = mask ^ bit
+                self._limit_calls(base_delay, interval, threshold)
+                self._place(depth, bit)
+                if self._dead:
+                    # a parte já explorada noutra tarefa
+                    self._unplace(depth)
+                    continue
+                depth += 1
+                continue
+
+            # no candidates left on this level, backtrack
+            frames.pop()
+            if depth == 0:
+                return False
+            depth -= 1
+            self._unplace(depth)
+
+
+    def solve_dlx(self, base_delay=None, interval=None, threshold=None) -> bool:
+        """Solves the Sudoku as an exact cover problem with Dancing Links."""
+        choices, rows = sudoku_matrix(self.grid)
+        links = DancingLinks(324, rows)
+
+        solution = links.search(lambda: self._limit_calls(base_delay, interval, threshold))
+        if solution is None:
+            return False
+
+        for row_id in solution:
+            r, c, num = choices[row_id]
+            self.grid[r][c] = num
+
+        return self.check(base_delay, interval, threshold)
+
+
+    def _serve_splits(self, depth):
+        with self._split_lock:
+            while self._split_requests:
+                self._split_requests.popleft().set_result(self._split(depth))
+
+
+    def _split(self, depth) -> list[tuple[tuple[int, int], list[list[int]]]]:
+        """Removes half of the untried candidates of the shallowest open level
+        and returns them as subproblems."""
+        frames = self._frames
+        for level in range(len(frames)):
+            if frames[level]:
+                break
+        else:
+            return []
+
+        # give away the higher half of the candidates
+        mask = frames[level]
+        give = max(1, mask.bit_count() // 2)
+        keep = mask
+        for _ in range(give):
+            keep &= ~(1 << (keep.bit_length() - 1))
+        frames[level] = keep
+
+        # puzzle with the assignments made above 'level'
+        puzzle = [row[:] for row in self.grid]
+        for r, c in self._cells[level:depth]:
+            puzzle[r][c] = 0
+
+        r, c = self._cells[level]
+        subproblems = []
+        stolen = mask ^ keep
+        while stolen:
+            bit = stolen & -stolen
+            stolen ^= bit
+            new_puzzle = [row[:] for row in puzzle]
+            new_puzzle[r][c] = bit.bit_length() - 1
+            subproblems.append(((r, c), new_puzzle))
+        self.given_away += len(subproblems)
+        return subproblems
+
+
+    def _init_masks(self) -> bool:
+        """Builds the candidate bitmasks from the current grid."""
+        self._rows = [0] * 9
+        self._cols = [0] * 9
+        self._boxes = [0] * 9
+        self._cells = []
+        self._frames = []
+
+        for r in range(9):
+            for c in range(9):
+                num = self.grid[r][c]
+                if num == 0:
+                    self._cells.append((r, c))
+                    continue
+
+                bit = 1 << num
+                b = BOX[r][c]
+                if (self._rows[r] | self._cols[c] | self._boxes[b]) & bit:
+                    return False
+                self._rows[r] |= bit
+                self._cols[c] |= bit
+                self._boxes[b] |= bit
+
+        return True
+
+
+    def propagate(self) -> bool:
+        """Fills the grid with naked singles, hidden singles and box/line
+        reductions until it stops changing.
+
+        Returns False if a contradiction was found.
+        """
+        if not self._init_masks():
+            return False
+
+        cand = [0] * 81
+        for r, c in self._cells:
+            cand[r * 9 + c] = self._candidates(r, c)
+
+        def assign(i, bit):
+            if not cand[i] & bit:
+                return False
+            self.grid[i // 9][i % 9] = bit.bit_length() - 1
+            cand[i] = 0
+            for p in PEERS[i]:
+                cand[p] &= ~bit
+            return True
+
+        changed = True
+        while changed:
+            changed = False
+
+            # naked singles
+            for i in range(81):
+                if self.grid[i // 9][i % 9]:
+                    continue
+                mask = cand[i]
+                if mask == 0:
+                    return False
+                if mask & (mask - 1) == 0:
+                    assign(i, mask)
+                    changed = True
+
+            # hidden singles
+            for unit in UNITS:
+                placed = 0
+                for i in unit:
+                    placed |= 1 << self.grid[i // 9][i % 9]
+                for num in range(1, 10):
+                    bit = 1 << num
+                    if placed & bit:
+                        continue
+                    places = [i for i in unit if cand[i] & bit]
+                    if not places:
+                        return False
+                    if len(places) == 1:
+                        if not assign(places[0], bit):
+                            return False
+                        placed |= bit
+                        changed = True
+
+            # box/line reductions
+            for box in UNITS[18:]:
+                for num in range(1, 10):
+                    bit = 1 << num
+                    places = [i for i in box if cand[i] & bit]
+                    if len(places) < 2:
+                        continue
+                    # pointing: digit confined to one row/column of the box
+                    for line in (places[0] // 9, 9 + places[0] % 9):
+                        if all(i in UNITS[line] for i in places):
+                            for i in UNITS[line]:
+                                if i not in box and cand[i] & bit:
+                                    cand[i] &= ~bit
+                                    changed = True
+
+            for line in UNITS[:18]:
+                for num in range(1, 10):
+                    bit = 1 << num
+                    places = [i for i in line if cand[i] & bit]
+                    if len(places) < 2:
+                        continue
+                    # claiming: digit confined to one box of the row/column
+                    b = 18 + BOX[places[0] // 9][places[0] % 9]
+                    if all(i in UNITS[b] for i in places):
+                        for i in UNITS[b]:
+                            if i not in line and cand[i] & bit:
+                                cand[i] &= ~bit
+                                changed = True
+
+        return True
+
+
+    def _init_nogoods(self) -> bool:
+        """Watches the literals of the nogoods that the empty cells can still complete.
+
+        Returns False if the grid already has every literal of a nogood.
+        """
+        self._watch = {} # literal: nogoods that have it
+        self._missing = [] # literals of each nogood that aren't on the grid
+        self._dead = 0 # nogoods with every literal on the grid
+
+        for nogood in self.nogoods:
+            missing = []
+            for literal in nogood:
+                r, c = divmod(literal // 9, 9)
+                num = self.grid[r][c]
+                if num == 0:
+                    missing.append(literal)
+                elif num != literal % 9 + 1:
+                    break # can't happen on this grid
+            else:
+                if not missing:
+                    self._dead += 1
+                for literal in missing:
+                    self._watch.setdefault(literal, []).append(len(self._missing))
+                self._missing.append(len(missing))
+
+        return not self._dead
+
+
+    def _candidates(self, row, col) -> int:
+        """Returns the candidate bitmask of the given cell."""
+        return ~(self._rows[row] | self._cols[col] | self._boxes[BOX[row][col]]) & ALL_DIGITS
+
+
+    def _pick_cell(self, depth) -> int:
+        """Moves the empty cell with fewest candidates to 'depth' and returns its candidates."""
+        cells = self._cells
+        best, best_mask, best_count = depth, 0, 10
+        for i in range(depth, len(cells)):
+            mask = self._candidates(*cells[i])
+            count = mask.bit_count()
+            if count < best_count:
+                best, best_mask, best_count = i, mask, count
+                if count <= 1:
+                    break
+
+        cells[depth], cells[best] = cells[best], cells[depth]
+        return best_mask
+
+
+    def _place(self, depth, bit):
+        r, c = self._cells[depth]
+        self._rows[r] |= bit
+        self._cols[c] |= bit
+        self._boxes[BOX[r][c]] |= bit
+        num = bit.bit_length() - 1
+        self.grid[r][c] = num
+        if self._watch:
+            for i in self._watch.get((r * 9 + c) * 9 + num - 1, ()):
+                self._missing[i] -= 1
+                if not self._missing[i]:
+                    self._dead += 1
+
+
+    def _unplace(self, depth):
+        r, c = self._cells[depth]
+        num = self.grid[r][c]
+        bit = 1 << num
+        self._rows[r] ^= bit
+        self._cols[c] ^= bit
+        self._boxes[BOX[r][c]] ^= bit
+        self.grid[r][c] = 0
+        if self._watch:
+            for i in self._watch.get((r * 9 + c) * 9 + num - 1, ()):
+                if not self._missing[i]:
+                    self._dead -= 1
+                self._missing[i] += 1
     
 
 
+def encode_board(grid: list[list[int]]) -> str:
+    """Packs a grid into an 81 character string."""
+    return "".join(str(num) for row in grid for num in row)
+
+
+def decode_board(board: str) -> list[list[int]]:
+    """Unpacks a grid packed with encode_board()."""
+    return [[int(num) for num in board[r * 9:r * 9 + 9]] for r in range(9)]
+
+
+def valid_grid(grid) -> bool:
+    """The grid is 9 rows of 9 integers from 0 (empty) to 9."""
+    return (isinstance(grid, list) and len(grid) == 9
+            and all(isinstance(row, list) and len(row) == 9
+                    and all(type(num) is int and 0 <= num <= 9 for num in row) for row in grid))
+
+
+def assignments(grid: list[list[int]], base: list[list[int]] = None) -> list[int]:
+    """Literals (cell * 9 + digit - 1) of the cells filled in 'grid' but not in 'base'."""
+    return [(r * 9 + c) * 9 + num - 1
+            for r, row in enumerate(grid) for c, num in enumerate(row)
+            if num and not (base and base[r][c])]
+
+
+def solve_board(board: str, engine: str, base_delay: float, cancel=None, nogoods=()) -> tuple[bool, str, int, dict]:
+    """Solves a packed board, meant to run in a worker process.
+
+    Returns if it was solved, the resulting board, the number of validations
+    and the limiter stats.
+    """
+    sudoku = Sudoku(decode_board(board), base_delay=base_delay, cancel=cancel, nogoods=nogoods)
+    solved = sudoku.solve(engine)
+    return solved, encode_board(sudoku.get_sudoku()), sudoku.get_check_count(), sudoku.get_limiter_stats()
+
+
+# solver engines available to Sudoku.solve()
+SOLVERS = {
+    "backtrack": "solve_sudoku",
+    "bitmask": "solve_bitmask",
+    "dlx": "solve_dlx",
+}
+# engines that can give away work with request_split()
+SPLITTABLE = ("bitmask",)
+
 
 if __name__ == "__main__":
     sudoku = Sudoku(
@@ -0,0 +1,54 @@
+'''Canonical form of a sudoku under its symmetries'''
+import random
+
+import pytest
+
+from cache import SolutionCache
+from canonical import ORDERS, IDENTITY, Transform, canonical
+
+PUZZLES = [
+    [[8, 0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 3, 6, 0, 0, 0, 0, 0], [0, 7, 0, 0, 9, 0, 2, 0, 0],
+     [0, 5, 0, 0, 0, 7, 0, 0, 0], [0, 0, 0, 0, 4, 5, 7, 0, 0], [0, 0, 0, 1, 0, 0, 0, 3, 0],
+     [0, 0, 1, 0, 0, 0, 0, 6, 8], [0, 0, 8, 5, 0, 0, 0, 1, 0], [0, 9, 0, 0, 0, 0, 4, 0, 0]],
+    [[7, 0, 0, 8, 6, 5, 9, 0, 0], [0, 0, 0, 7, 9, 0, 2, 0, 0], [0, 1, 0, 0, 4, 3, 0, 7, 0],
+     [2, 3, 1, 0, 0, 0, 0, 0, 0], [4, 0, 7, 0, 1, 2, 5, 8, 0], [8, 0, 0, 0, 3, 7, 1, 0, 6],
+     [1, 0, 0, 6, 0, 9, 0, 0, 4], [9, 4, 0, 0, 5, 0, 0, 0, 0], [0, 5, 2, 3, 0, 0, 0, 0, 0]],
+]
+SOLUTION = [[8, 1, 2, 7, 5, 3, 6, 4, 9], [9, 4, 3, 6, 8, 2, 1, 7, 5], [6, 7, 5, 4, 9, 1, 2, 8, 3],
+            [1, 5, 4, 2, 3, 7, 8, 9, 6], [3, 6, 9, 8, 4, 5, 7, 2, 1], [2, 8, 7, 1, 6, 9, 5, 3, 4],
+            [5, 2, 1, 9, 7, 4, 3, 6, 8], [4, 3, 8, 5, 2, 6, 9, 1, 7], [7, 9, 6, 3, 1, 8, 4, 5, 2]]
+
+
+def random_transform(rng: random.Random) -> Transform:
+    return Transform(rng.random() < 0.5, rng.choice(ORDERS), rng.choice(ORDERS), [0] + rng.sample(range(1, 10), 9))
+
+
+@pytest.mark.parametrize("grid", PUZZLES + [SOLUTION])
+def test_invert_undoes_apply(grid):
+    rng = random.Random(1)
+    for _ in range(50):
+        transform = random_transform(rng)
+        assert transform.invert(transform.apply(grid)) == grid
+    assert IDENTITY.apply(grid) == grid
+
+
+@pytest.mark.parametrize("grid", PUZZLES)
+def test_canonical_is_invariant(grid):
+    rng = random.Random(2)
+    canon, transform = canonical(grid)
+    assert transform.apply(grid) == canon
+    for _ in range(5):
+        moved = random_transform(rng).apply(grid)
+        moved_canon, moved_transform = canonical(moved)
+        assert moved_canon == canon
+        assert moved_transform.invert(moved_canon) == moved
+
+
+def test_cache_finds_equivalent_sudokus():
+    rng = random.Random(3)
+    cache = SolutionCache()
+    assert cache.put(PUZZLES[0], SOLUTION)
+    for _ in range(3):
+        transform = random_transform(rng)
+        assert cache.get(transform.apply(PUZZLES[0])) == transform.apply(SOLUTION)
+    assert cache.get(PUZZLES[1]) is None
@@ -0,0 +1,109 @@
+'''Tasks of a job, and copies of the slow ones given to idle nodes'''
+import threading
+import time
+
+from job import MAX_SPECULATIVE, SolveJob
+from sudoku import assignments
+
+GRID = [[0] * 9 for _ in range(9)]
+SLOW = ("10.0.0.1", 7001)
+IDLE = ("10.0.0.2", 7002)
+
+
+def running_job(count: int = 1, age: float = 10) -> SolveJob:
+    """A job whose tasks were taken by SLOW 'age' seconds ago"""
+    job = SolveJob("id", GRID, "backtrack", threading.Event())
+    job.add_tasks([(i, GRID) for i in range(count)])
+    taken = job.take(SLOW, count)
+    for task_id, _ in taken:
+        job.ledger[task_id] = (SLOW, time.time() - age)
+    return job
+
+
+def test_no_copies_while_tasks_are_queued():
+    job = running_job()
+    job.add_tasks([(1, GRID)])
+    assert job.speculate(IDLE) == []
+
+
+def test_young_tasks_are_not_copied():
+    job = running_job(age=0)
+    assert job.speculate(IDLE) == []
+
+
+def test_copy_of_the_oldest_task():
+    job = running_job(count=2)
+    job.ledger[1] = (SLOW, time.time() - 20)
+    (task_id, _), = job.speculate(IDLE)
+    assert task_id == 1
+    assert job.assigned(IDLE) == 1
+    # uma tarefa só tem uma cópia
+    (task_id, _), = job.speculate(("10.0.0.3", 7003))
+    assert task_id == 0
+    assert job.speculate(("10.0.0.4", 7004)) == []
+
+
+def test_copies_per_job_are_capped():
+    job = running_job(count=MAX_SPECULATIVE + 2)
+    assert len(job.speculate(IDLE, MAX_SPECULATIVE + 2)) == MAX_SPECULATIVE
+    assert job.speculated == MAX_SPECULATIVE
+
+
+def test_first_copy_to_finish_wins():
+    job = running_job()
+    job.speculate(IDLE)
+    assert job.drop_rival(IDLE, 0) == SLOW
+    assert job.assigned(SLOW) == 0
+    assert job.release(IDLE, 0)
+    # a resposta do node parado não conta
+    assert job.drop_rival(SLOW, 0) is None
+    assert job.tried == 1
+
+
+def test_original_owner_wins():
+    job = running_job()
+    job.speculate(IDLE)
+    assert job.drop_rival(SLOW, 0) == IDLE
+    assert job.assigned(IDLE) == 0
+    assert job.release(SLOW, 0)
+
+
+def test_failed_copy_is_not_queued_again():
+    job = running_job()
+    job.speculate(IDLE)
+    assert job.requeue(IDLE) == 0
+    assert job.queue.empty()
+    assert job.ledger[0][0] == SLOW
+
+
+def test_failed_owner_leaves_the_task_to_the_copy():
+    job = running_job()
+    job.speculate(IDLE)
+    assert job.requeue(SLOW) == 0
+    assert job.queue.empty()
+    assert job.ledger[0][0] == IDLE
+    assert job.release(IDLE, 0)
+
+
+def test_pruning_the_last_tasks_empties_the_job():
+    job = SolveJob("id", GRID, "backtrack", threading.Event())
+    task = [row[:] for row in GRID]
+    task[0][0] = 5
+    job.add_tasks([(0, task)])
+    (task_id, _), = job.take(SLOW)
+    # passou o prazo e voltou para a fila, depois o node respondeu com um nogood
+    assert job.requeue(SLOW, [task_id]) == 1
+    job.add_nogood(assignments(task))
+    assert not job.release(SLOW, task_id)
+    assert not job.emptied
+    assert job.take(IDLE) == []
+    assert job.emptied and job.exhausted()
+
+
+def test_tasks_younger_than_twice_the_usual_time_are_not_copied():
+    job = running_job(count=2, age=5)
+    job.durations.extend([3.0, 3.0])
+    assert job.speculate(IDLE) == []
+    job.ledger[1] = (SLOW, time.time() - 7)
+    (task_id, _), = job.speculate(IDLE)
+    assert task_id == 1
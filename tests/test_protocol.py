@@ -0,0 +1,94 @@
+'''Round trips of the binary and json encodings and of the message framing'''
+import uuid
+
+import pytest
+
+from protocol import CDProto, CDProtoBadFormat, FrameReader, HEADER_SIZE
+
+PUZZLE = [[8, 0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 3, 6, 0, 0, 0, 0, 0], [0, 7, 0, 0, 9, 0, 2, 0, 0],
+          [0, 5, 0, 0, 0, 7, 0, 0, 0], [0, 0, 0, 0, 4, 5, 7, 0, 0], [0, 0, 0, 1, 0, 0, 0, 3, 0],
+          [0, 0, 1, 0, 0, 0, 0, 6, 8], [0, 0, 8, 5, 0, 0, 0, 1, 0], [0, 9, 0, 0, 0, 0, 4, 0, 0]]
+SOLVED = [[8, 1, 2, 7, 5, 3, 6, 4, 9], [9, 4, 3, 6, 8, 2, 1, 7, 5], [6, 7, 5, 4, 9, 1, 2, 8, 3],
+          [1, 5, 4, 2, 3, 7, 8, 9, 6], [3, 6, 9, 8, 4, 5, 7, 2, 1], [2, 8, 7, 1, 6, 9, 5, 3, 4],
+          [5, 2, 1, 9, 7, 4, 3, 6, 8], [4, 3, 8, 5, 2, 6, 9, 1, 7], [7, 9, 6, 3, 1, 8, 4, 5, 2]]
+SUDOKU_ID = str(uuid.uuid4())
+
+
+def round_trip(message, encoding):
+    data = message.encode(encoding)
+    assert (data[:1] == b'{') == (encoding == "json")
+    return CDProto.decode(data).to_dict()
+
+
+@pytest.mark.parametrize("encoding", ["binary", "json"])
+def test_solve(encoding):
+    task = [[7, 1], [row[:] for row in PUZZLE]]
+    task[1][7][1] = 2
+    message = CDProto.solve([[3, task], [70000, [[0, 6], PUZZLE]]], SUDOKU_ID, PUZZLE, "bitmask", [[1, 728], [5]], 2)
+    decoded = round_trip(message, encoding)
+    assert decoded["command"] == "solve"
+    assert decoded["sudokuId"] == SUDOKU_ID
+    assert decoded["tasks"] == [[3, task], [70000, [[0, 6], PUZZLE]]]
+    assert decoded["cache"] == PUZZLE
+    assert decoded["solver"] == "bitmask"
+    assert decoded["nogoods"] == [[1, 728], [5]]
+    assert decoded["hops"] == 2
+
+
+@pytest.mark.parametrize("encoding", ["binary", "json"])
+@pytest.mark.parametrize("solved, grid, nogood", [(True, SOLVED, None), (False, PUZZLE, [0, 100, 728]), (False, PUZZLE, None)])
+def test_solution(encoding, solved, grid, nogood):
+    decoded = round_trip(CDProto.solution(grid, SUDOKU_ID, solved, 12, 3, nogood), encoding)
+    assert decoded["command"] == "solution"
+    assert decoded["sudoku"] == grid
+    assert decoded["sudokuId"] == SUDOKU_ID
+    assert decoded["solution"] is solved
+    assert decoded["taskId"] == 12
+    assert decoded["credit"] == 3
+    assert decoded["nogood"] == nogood
+
+
+@pytest.mark.parametrize("encoding", ["binary", "json"])
+def test_keep_alive(encoding):
+    decoded = round_trip(CDProto.keep_alive(4, 2 ** 40, "192.0.2.2:7001", 12.3456), encoding)
+    assert decoded["command"] == "keep_alive"
+    assert decoded["status"] == {"solved": 4, "validations": 2 ** 40, "busy": 12.346}
+    assert decoded["IP"] == "192.0.2.2:7001"
+
+
+def test_solve_without_uuid_is_sent_as_json():
+    data = CDProto.solve([[0, [[0, 0], PUZZLE]]], "not-a-uuid", PUZZLE, "bitmask").encode("binary")
+    assert CDProto.decode(data).to_dict()["sudokuId"] == "not-a-uuid"
+
+
+def test_frame_reader_split_reads():
+    messages = [CDProto.solution(SOLVED, SUDOKU_ID, True, 1, 2).encode("binary"),
+                CDProto.keep_alive_reply().encode("json"),
+                CDProto.solve([[0, [[0, 0], PUZZLE]]], SUDOKU_ID, PUZZLE, "dlx").encode("binary")]
+    stream = b''.join(map(CDProto.frame, messages))
+
+    # one byte at a time, a message split across reads comes out whole
+    reader = FrameReader()
+    frames = []
+    for i in range(len(stream)):
+        frames.extend(reader.feed(stream[i:i + 1]))
+    assert frames == messages
+
+    # all at once
+    assert FrameReader().feed(stream) == messages
+
+    # the header split from the body
+    reader = FrameReader()
+    assert reader.feed(stream[:HEADER_SIZE - 1]) == []
+    assert reader.feed(stream[HEADER_SIZE - 1:]) == messages
+
+
+def test_frame_reader_rejects_huge_frames():
+    with pytest.raises(CDProtoBadFormat):
+        FrameReader().feed(b'\xff' * HEADER_SIZE)
+
+
+def test_decode_rejects_garbage():
+    for data in (b'{not json', b'\xfe\x00', b''):
+        with pytest.raises(CDProtoBadFormat):
+            CDProto.decode(data)
@@ -0,0 +1,145 @@
+'''Solver engines, constraint propagation and the splitting of a sudoku into tasks'''
+import ast
+import os
+import re
+
+import pytest
+
+from sudoku import Sudoku
+
+
+def examples() -> list[list]:
+    """The grids of each example of resulution.txt, the puzzle first and then its solutions"""
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resulution.txt")
+    with open(path) as file:
+        sections = re.split(r'^\d+ --', file.read(), flags=re.M)[1:]
+    return [[ast.literal_eval(grid) for grid in re.findall(r'\[\s*\[.*?\]\s*,?\s*\]', section, re.S)]
+            for section in sections]
+
+
+EXAMPLES = [grids for grids in examples() if len(grids) > 1]
+SOLUTIONS = [grid for grids in examples() for grid in grids if not any(0 in row for row in grid)]
+
+
+def copy(grid):
+    return [row[:] for row in grid]
+
+
+def extends(grid, puzzle) -> bool:
+    """'grid' keeps every digit of 'puzzle'"""
+    return all(puzzle[r][c] in (0, grid[r][c]) for r in range(9) for c in range(9))
+
+
+def test_examples_are_read():
+    assert len(EXAMPLES) == 2
+    assert len(SOLUTIONS) == 4
+
+
+@pytest.mark.parametrize("solution", SOLUTIONS)
+def test_solutions_are_valid(solution):
+    assert Sudoku(copy(solution), base_delay=0).check()
+
+
+@pytest.mark.parametrize("engine", ["bitmask", "dlx"])
+@pytest.mark.parametrize("example", EXAMPLES)
+def test_engines_solve_the_examples(engine, example):
+    puzzle, *solutions = example
+    sudoku = Sudoku(copy(puzzle), base_delay=0)
+    assert sudoku.solve(engine)
+    grid = sudoku.get_sudoku()
+    assert Sudoku(copy(grid), base_delay=0).check()
+    assert extends(grid, puzzle)
+    if len(solutions) == 1:
+        # só tem uma solução, todos os motores a encontram
+        assert grid == solutions[0]
+
+
+def test_engines_agree_there_is_no_solution():
+    puzzle = [[0] * 9 for _ in range(9)]
+    puzzle[0][:8] = [1, 2, 3, 4, 5, 6, 7, 8]
+    puzzle[1][8] = 9
+    for engine in ("bitmask", "dlx"):
+        assert not Sudoku(copy(puzzle), base_delay=0).solve(engine)
+
+
+def test_propagate_solves_an_easy_puzzle():
+    puzzle, solution = EXAMPLES[0]
+    sudoku = Sudoku(copy(puzzle), base_delay=0)
+    assert sudoku.propagate()
+    assert sudoku.get_empty_lines() == []
+    assert sudoku.get_sudoku() == solution
+
+
+def test_propagate_fills_only_forced_cells():
+    puzzle, *solutions = EXAMPLES[1]
+    sudoku = Sudoku(copy(puzzle), base_delay=0)
+    assert sudoku.propagate()
+    grid = sudoku.get_sudoku()
+    assert sudoku.get_empty_lines()
+    # o puzzle tem mais que uma solução, o que a propagação preenche está em todas
+    for solution in solutions:
+        assert extends(solution, grid)
+
+
+@pytest.mark.parametrize("cells", [
+    {(0, c): c + 1 for c in range(8)} | {(1, 8): 9}, # (0, 8) sem candidatos
+    {(0, 0): 5, (0, 1): 5}, # o mesmo dígito duas vezes numa linha
+])
+def test_propagate_finds_contradictions(cells):
+    puzzle = [[0] * 9 for _ in range(9)]
+    for (r, c), num in cells.items():
+        puzzle[r][c] = num
+    assert not Sudoku(puzzle, base_delay=0).propagate()
+
+
+@pytest.mark.parametrize("target", [1, 8, 40])
+def test_generate_puzzles_covers_the_puzzle(target):
+    puzzle, *solutions = EXAMPLES[1]
+    puzzles = Sudoku(copy(puzzle), base_delay=0).generate_puzzles(target)
+    assert len(puzzles) >= target
+    grids = [grid for _, grid in puzzles]
+    for grid in grids:
+        assert extends(grid, puzzle)
+    # os subproblemas não se sobrepõem, e cada solução está em exatamente um
+    for i, a in enumerate(grids):
+        for b in grids[i + 1:]:
+            assert any(a[r][c] and b[r][c] and a[r][c] != b[r][c] for r in range(9) for c in range(9))
+    for solution in solutions:
+        assert sum(extends(solution, grid) for grid in grids) == 1
+
+
+def test_generate_puzzles_of_a_full_grid():
+    assert Sudoku(copy(SOLUTIONS[0]), base_delay=0).generate_puzzles(4) is None
+
+
+def test_split_gives_away_half_of_an_open_level():
+    puzzle = EXAMPLES[1][0]
+    sudoku = Sudoku(copy(puzzle), base_delay=0)
+    assert sudoku._init_masks() and sudoku._init_nogoods()
+    # descer dois níveis como o solver, com o menor candidato de cada célula
+    for depth in range(2):
+        sudoku._frames.append(sudoku._pick_cell(depth))
+        bit = sudoku._frames[depth] & -sudoku._frames[depth]
+        sudoku._frames[depth] ^= bit
+        sudoku._place(depth, bit)
+    level = next(level for level, mask in enumerate(sudoku._frames) if mask)
+    untried = sudoku._frames[level]
+    grid = sudoku.get_sudoku()
+
+    subproblems = sudoku._split(2)
+    kept = sudoku._frames[level]
+    given = sum(1 << subproblem[r][c] for (r, c), subproblem in subproblems)
+    # os candidatos por explorar ficam divididos entre o solver e os subproblemas
+    assert kept & given == 0 and kept | given == untried
+    assert len(subproblems) == max(1, untried.bit_count() // 2)
+    assert sudoku.given_away == len(subproblems)
+
+    r, c = sudoku._cells[level]
+    for cell, subproblem in subproblems:
+        assert cell == (r, c)
+        # só as atribuições acima do nível se mantêm
+        expected = copy(grid)
+        for row, col in sudoku._cells[level:2]:
+            expected[row][col] = 0
+        expected[r][c] = subproblem[r][c]
+        assert subproblem == expected
@@ -0,0 +1,65 @@
+'''Throughput estimates of the nodes'''
+from throughput import MIN_WEIGHT, PeerSpeed
+
+FAST = "10.0.0.1:7001"
+SLOW = "10.0.0.2:7002"
+
+
+def test_unknown_nodes_count_as_fast():
+    speeds = PeerSpeed()
+    assert speeds.weight(FAST) == 1.0
+    assert speeds.weight(None) == 1.0
+    assert speeds.stats() == {}
+
+
+def test_rate_over_the_time_the_solvers_ran():
+    speeds = PeerSpeed(alpha=0.5)
+    speeds.report(FAST, 0, 0)
+    speeds.report(FAST, 1000, 1)
+    assert speeds.stats()[FAST]["rate"] == 1000
+    speeds.report(FAST, 4000, 2)
+    assert speeds.stats()[FAST]["rate"] == 2000
+
+
+def test_idle_time_is_not_slowness():
+    speeds = PeerSpeed(alpha=1)
+    speeds.report(FAST, 0, 0.0)
+    speeds.report(FAST, 1000, 2.0)
+    # parado: nem as validações nem o tempo dos solvers crescem
+    for _ in range(10):
+        speeds.report(FAST, 1000, 2.0)
+    speeds.report(FAST, 2000, 4.0)
+    assert speeds.stats()[FAST]["rate"] == 500
+    # o node reiniciou
+    speeds.report(FAST, 10, 0.5)
+    speeds.report(FAST, 310, 1.0)
+    assert speeds.stats()[FAST]["rate"] == 600
+
+
+def test_nodes_without_solver_time_are_left_out():
+    speeds = PeerSpeed()
+    speeds.report(FAST, 0, None)
+    speeds.report(FAST, 1000, None)
+    assert speeds.stats() == {}
+
+
+def test_weight_relative_to_the_fastest():
+    speeds = PeerSpeed(alpha=1)
+    for address, rate in ((FAST, 1000), (SLOW, 500)):
+        speeds.report(address, 0, 0)
+        speeds.report(address, rate, 1)
+    assert speeds.weight(FAST) == 1.0
+    assert speeds.weight(SLOW) == 0.5
+
+    speeds.report(SLOW, 510, 2)
+    assert speeds.weight(SLOW) == MIN_WEIGHT
+
+
+def test_task_time_when_the_rate_is_unknown():
+    speeds = PeerSpeed()
+    speeds.task_done(FAST, 1.0)
+    speeds.task_done(SLOW, 2.0)
+    assert speeds.weight(SLOW) == 0.5
+    speeds.forget(SLOW)
+    assert speeds.weight(SLOW) == 1.0
+    assert list(speeds.stats()) == [FAST]
@@ -0,0 +1,74 @@
+'''Throughput of the nodes, to give more work to the faster ones'''
+import threading
+
+SPEED_ALPHA = 0.3 # weight of the newest sample in the moving averages
+MIN_WEIGHT = 0.25 # share of its credit the slowest nodes get
+
+
+class PeerSpeed:
+    """Moving averages of the validations per second and the task time of each node
+
+    The validations come from the stats the nodes send in keep_alive messages,
+    divided by the seconds the solvers of the node ran meanwhile, so the time
+    a node spends idle doesn't count as slowness.
+    """
+
+    def __init__(self, alpha: float = SPEED_ALPHA):
+        self.alpha = alpha
+        self.rates = {} # address: validations per second
+        self.task_times = {} # address: seconds a task sent to the node takes
+        self.reports = {} # address: (validations, busy seconds) of the last stats of the node
+        self.lock = threading.Lock()
+
+    def report(self, address: str, validations: int, busy: float | None):
+        """Take the validations and the seconds its solvers ran a node reported, smaller ones if it restarted"""
+        if busy is None:
+            # o node não envia o tempo dos solvers
+            return
+        with self.lock:
+            last = self.reports.get(address)
+            if last is None or validations < last[0] or busy < last[1]:
+                self.reports[address] = (validations, busy)
+                return
+            done, seconds = validations - last[0], busy - last[1]
+            if done > 0 and seconds > 0:
+                self.reports[address] = (validations, busy)
+                self._average(self.rates, address, done / seconds)
+
+    def task_done(self, address: str, seconds: float):
+        """Take the time a node took to finish a task"""
+        with self.lock:
+            self._average(self.task_times, address, seconds)
+
+    def weight(self, address: str) -> float:
+        """Speed of a node relative to the fastest one, from MIN_WEIGHT to 1, 1 if unknown"""
+        with self.lock:
+            return self._weight(address)
+
+    def forget(self, address: str):
+        """Drop the estimates of a node that left"""
+        with self.lock:
+            for averages in (self.rates, self.task_times, self.reports):
+                averages.pop(address, None)
+
+    def stats(self) -> dict:
+        """The estimates of each node, address: {validations per second, task time, weight}"""
+        with self.lock:
+            return {address: {"rate": round(self.rates.get(address, 0), 1),
+                              "task_time": round(self.task_times.get(address, 0), 3),
+                              "weight": round(self._weight(address), 2)}
+                    for address in self.rates.keys() | self.task_times.keys()}
+
+    def _average(self, averages: dict, address: str, sample: float):
+        old = averages.get(address)
+        averages[address] = sample if old is None else old + self.alpha * (sample - old)
+
+    def _weight(self, address: str) -> float:
+        # as validações por segundo contam mais que o tempo das tarefas, que varia com o seu tamanho
+        rate = self.rates.get(address)
+        if rate is not None:
+            return max(MIN_WEIGHT, rate / max(self.rates.values()))
+        task_time = self.task_times.get(address)
+        if task_time:
+            return max(MIN_WEIGHT, min(1.0, min(self.task_times.values()) / task_time))
+        return 1.0
@@ -0,0 +1,52 @@
+'''Timers run by the selector loop'''
+import threading
+import time
+
+
+class TimerWheel:
+    """Hashed timing wheel, the callbacks run in the thread that calls run()"""
+
+    def __init__(self, tick: float = 0.1, slots: int = 512):
+        self.tick = tick # seconds between two slots
+        self.slots = [[] for _ in range(slots)] # timers by deadline tick, modulo the number of slots
+        self.start = time.monotonic()
+        self.current = 0 # next tick to run
+        self.lock = threading.Lock()
+
+    def schedule(self, delay: float, callback, *args) -> list:
+        """Run 'callback(*args)' in 'delay' seconds
+        Returns:
+            list: the timer, to cancel it
+        """
+        with self.lock:
+            deadline = max(self.current, int((time.monotonic() + delay - self.start) / self.tick) + 1)
+            timer = [deadline, callback, args]
+            self.slots[deadline % len(self.slots)].append(timer)
+        return timer
+
+    def cancel(self, timer: list):
+        """Don't run a timer"""
+        timer[1] = None
+
+    def timeout(self) -> float:
+        """Seconds until the next tick, for selector.select()"""
+        return max(0.0, self.start + self.current * self.tick - time.monotonic())
+
+    def run(self):
+        """Run the timers that are due"""
+        now = int((time.monotonic() - self.start) / self.tick)
+        while self.current <= now:
+            with self.lock:
+                slot = self.slots[self.current % len(self.slots)]
+                # timers of the next turns of the wheel stay in the slot
+                due = [timer for timer in slot if timer[0] <= self.current]
+                slot[:] = [timer for timer in slot if timer[0] > self.current]
+                self.current += 1
+
+            for _, callback, args in due:
+                if callback is None:
+                    continue
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(f"Erro no timer {callback}: {e}")